@@ -2,7 +2,7 @@ import os
 import itertools
 import subprocess
 from odbc_utils import *
-from timing import tik, tok
+from timing import tik, tok, tracer
 
 os.environ["II_ODBC_WCHAR_SIZE"] = "2"
 
@@ -13,10 +13,26 @@ def find_in_path(executable):
             return True
     return False
 
-class GraphPartitioner:
-    from identifier_mapping_dict import partition_identifier_mapping_dict as id_map
+def read_binary_edges(filename, mmap = True):
+    '''
+    Returns the edges of a binary edgefile of GraphPartitioner.table_to_graph as (t0, t1) int64 arrays,
+    memory-mapped by default.
+    '''
+    import numpy as np
+    if mmap:
+        edges = np.memmap(filename, dtype=np.int64, mode='r').reshape(-1, 2)
+    else:
+        edges = np.fromfile(filename, dtype=np.int64).reshape(-1, 2)
+    return (edges[:, 0], edges[:, 1])
 
-    def __init__(self, connection, table, cols, partitions, verbose = False, apply = True, print_stats = False, mode = 0, waittime = 0):
+class GraphPartitioner:
+    def __init__(self, connection, table, cols, partitions, verbose = False, apply = True, print_stats = False, mode = 0, waittime = 0, sparsify = None, loader = None):
+        '''
+        sparsify: For tuples as vertices, connect the tuples sharing a key value by a "star" (all to the
+            tuple with the smallest tid) or a "chain" (in tid order) instead of a clique, so the number
+            of edges is linear instead of quadratic in the group sizes. None keeps the cliques.
+        loader: edge_loader.EdgeLoader for the partitioned edges, chosen by edge_loader.default_loader if not given.
+        '''
         self.table = table
         self.cols = cols
         self.partitions = partitions
@@ -26,15 +42,27 @@ class GraphPartitioner:
         self.partition_identifier_mapping = None
         self.connection = connection
         self.waittime = waittime
+        assert sparsify in (None, "star", "chain"), "sparsify must be None, \"star\" or \"chain\""
+        self.sparsify = sparsify
+        self.loader = loader
+        # Set by table_to_edges_client
+        self.client_graph = None
+        # Set by table_to_edges_parallel, the id mappings are tables readable by every connection
+        self.shared_id_mappings = False
+        # Set by graph_to_table: whether graph_partition holds the translated partition identifiers
+        # (see _create_partition_identifier_mapping), None before graph_partition is written
+        self.graph_part_translated = None
         if mode == 0: # tuples as edges
             self.table_to_graph = self.table_to_graph_t_as_e
+            self.edge_query = self._edge_query_t_as_e
             self.update_table_with_graph_part = self._update_table_with_graph_part_t_as_e
         elif mode == 1: # tuples as vertices
             self.table_to_graph = self.table_to_graph_t_as_v
+            self.edge_query = self._edge_query_t_as_v
             self.update_table_with_graph_part = self._update_table_with_graph_part_t_as_v
         else:
             assert False, "Mode must be 0 for tuples as edges or 1 for tuples as vertices"
-        assert len(cols) <= 3, "Currently only implemented graph-table mappings for at most 3 columns"
+        assert mode == 1 or len(cols) >= 2, "Tuples as edges needs at least 2 columns"
 
     def _get_partition_multiplier(self):
         q = f"select top 1 tid/10000000000000000, count(*) as part from {self.table} " \
@@ -42,26 +70,48 @@ class GraphPartitioner:
         cur = execute(self.connection, q, self.verbose)
         return cur.fetchone()[1]
 
-    def _declare_id_mappings(self):
-        
-        assert(hasattr(self, "col_id_offsets"))
-        
+    def _id_mapping_query(self, i):
+        '''
+        Value -> vertex id mapping of column i: the smallest normalized tid of the value, shifted by the ids of the previous columns.
+        '''
         tid_normalization = f"mod(tid, 10000000000000000) + ({self.partition_multiplier} * (tid/10000000000000000))"
 
-        mappings = []
         cum_off = [0]
-        for i in range(1, len(self.cols)): cum_off.append(cum_off[i-1] + self.col_id_offsets[i])
+        for j in range(1, len(self.cols)): cum_off.append(cum_off[j-1] + self.col_id_offsets[j])
+        off_str = "+ {}".format(cum_off[i]) if cum_off[i] > 0 else ""
+        return f"select {self.cols[i]}, min({tid_normalization}) {off_str} as id from {self.table} group by {self.cols[i]}"
+
+    def _declare_id_mappings(self, shared = False):
+        '''
+        Declares the id mapping of every column as temporary table, or with shared as table that other
+        connections can read as well (dropped again by graph_to_table).
+        '''
+        assert(hasattr(self, "col_id_offsets"))
 
+        mappings = []
         for i in range(len(self.cols)):
-            map_name = f"{self.cols[i]}_mapping"
-            off_str = "+ {}".format(cum_off[i]) if cum_off[i] > 0 else ""
-            q = f"DECLARE GLOBAL TEMPORARY TABLE {map_name} as " \
-                f"select {self.cols[i]}, min({tid_normalization}) {off_str} as id from {self.table} group by {self.cols[i]}" 
+            if shared:
+                map_name = f"{self.table}_{self.cols[i]}_mapping"
+                execute(self.connection, f"Drop table if exists {map_name}", self.verbose).close()
+                q = f"Create table {map_name} as {self._id_mapping_query(i)}"
+            else:
+                map_name = f"{self.cols[i]}_mapping"
+                q = f"DECLARE GLOBAL TEMPORARY TABLE {map_name} as {self._id_mapping_query(i)}"
             cur = execute(self.connection, q, self.verbose)
             cur.close()
             mappings.append(map_name)
+        if shared:
+            commit(self.connection)
+        self.shared_id_mappings = shared
         return mappings
 
+    def _drop_shared_id_mappings(self):
+        if not self.shared_id_mappings:
+            return
+        for map_name in self.col_id_mappings:
+            execute(self.connection, f"Drop table if exists {map_name}", self.verbose).close()
+        self.shared_id_mappings = False
+
 
     def _get_column_id_offsets(self):
         col_id_offsets = [0] # First col has no offset
@@ -81,81 +131,278 @@ class GraphPartitioner:
         '''
         Graph partitions have identifiers from 0 to self.partitions-1 after running the partitioning. 
         However, when using a DBMS's hash partitioning, this does not neccessarily lead to n balanced
-        partitions. Therefore, we replace identifiers 10..n-1 with identifiers that lead to a balanced partitioning.
+        partitions. Therefore, we replace identifiers 0..n-1 with identifiers that lead to a balanced partitioning.
         As the inverse function of the hash function does not exist, we determine the replacement
-        by trying different arguments until we get an identifier for each of the n buckets. 
+        by trying different arguments until we get an identifier for each of the n buckets
+        (see identifier_mapping_cache, probed mappings are cached on disk).
         NOTE: This assumes that the hash function used for partitioning is accessible.
         '''
+        from identifier_mapping_cache import get_identifier_mapping
 
-        self.partition_identifier_mapping = self.id_map.get(self.partitions)
+        self.partition_identifier_mapping = get_identifier_mapping(self.partitions, self.connection, verbose = self.verbose)
+        assert self.partition_identifier_mapping is not None, "Cannot find a partition identifier mapping"
 
-        if self.partition_identifier_mapping is not None: 
-            if self.verbose: print("Using existing partition identifier mapping from the global dictionary.")
-            return
-
-        self.partition_identifier_mapping = [0] * self.partitions
-        filled = 0
-        i = self.partitions + 1 # Start with higher id to avoid conflicts when replacing
-        while filled != self.partitions:
-            cur = execute(self.connection, f"Select top 1 mod(hash({i}), {self.partitions}) from {self.table}", self.verbose)
-            bucket = cur.fetchone()[0]
-            if (self.partition_identifier_mapping[bucket] == 0):
-                self.partition_identifier_mapping[bucket] = i
-                filled += 1
-            cur.close()
-            i += 1
-            assert i < self.random_min, "Cannot find an partition id mapping "\
-                "with values less than the current minimum for random assignment "\
-                f"to exceptions. (Current min is {self.random_min}."
-        print(self.partition_identifier_mapping)
+    def _prepare_t_as_e(self, shared = False):
+        self.partition_multiplier = self._get_partition_multiplier()
+        self.col_id_offsets = self._get_column_id_offsets()
+        self.col_id_mappings = self._declare_id_mappings(shared)
 
-    def table_to_graph_t_as_e(self, filename):
+    def _edge_subqueries_t_as_e(self, tid_range = None):
+        '''
+        One edge query per column pair. tid_range restricts the edges to the tuples with lo <= tid <= hi.
+        '''
         num_cols = len(self.cols)
         combs = list(itertools.combinations(range(0,num_cols), 2))
+        mappings = self.col_id_mappings
+        range_str = f"where t.tid between {tid_range[0]} and {tid_range[1]} " if tid_range else ""
 
-        self.partition_multiplier = self._get_partition_multiplier()
-        self.col_id_offsets = self._get_column_id_offsets()
-        self.col_id_mappings = self._declare_id_mappings()
-        q = f"select x.id as id1, y.id as id2 from {self.table} as t " \
-            f"INNER JOIN {self.col_id_mappings[combs[0][0]]} as x on (t.{self.cols[combs[0][0]]} = x.{self.cols[combs[0][0]]} " \
-            f"OR t.{self.cols[combs[0][0]]} is null and x.{self.cols[combs[0][0]]} is null) " \
-            f"INNER JOIN {self.col_id_mappings[combs[0][1]]} as y on (t.{self.cols[combs[0][1]]} = y.{self.cols[combs[0][1]]} " \
-            f"OR t.{self.cols[combs[0][1]]} is null and y.{self.cols[combs[0][1]]} is null) "
-        
-        for i in range(1, len(combs)):
-            q += f"UNION ALL select x.id as id1, y.id as id2 from {self.table} as t " \
-                f"INNER JOIN {self.col_id_mappings[combs[i][0]]} as x on (t.{self.cols[combs[i][0]]} = x.{self.cols[combs[i][0]]} " \
-                f"OR t.{self.cols[combs[i][0]]} is null and x.{self.cols[combs[i][0]]} is null) " \
-                f"INNER JOIN { self.col_id_mappings[combs[i][1]]} as y on (t.{self.cols[combs[i][1]]} = y.{self.cols[combs[i][1]]} " \
-                f"OR t.{self.cols[combs[i][1]]} is null and y.{self.cols[combs[i][1]]} is null) " 
-        
-        cur = execute(self.connection, q, self.verbose)
-        f = open(filename, "w")
-        for row in cur:
-            f.write(f"{row[0]} {row[1]}\n")
-        f.close()
+        queries = []
+        for i, j in combs:
+            queries.append(f"select x.id as id1, y.id as id2 from {self.table} as t " \
+                f"INNER JOIN {mappings[i]} as x on (t.{self.cols[i]} = x.{self.cols[i]} " \
+                f"OR t.{self.cols[i]} is null and x.{self.cols[i]} is null) " \
+                f"INNER JOIN {mappings[j]} as y on (t.{self.cols[j]} = y.{self.cols[j]} " \
+                f"OR t.{self.cols[j]} is null and y.{self.cols[j]} is null) {range_str}")
+        return queries
+
+    def _edge_query_t_as_e(self):
+        self._prepare_t_as_e()
+        return "UNION ALL ".join(self._edge_subqueries_t_as_e())
+
+    def _fetch_edge_batches(self, cur, fetch_size):
+        '''
+        Yields the edges of cur in batches, as views of one preallocated (fetch_size, 2) int64 buffer.
+        '''
+        import numpy as np
+        from itertools import chain
+        buffer = np.empty((fetch_size, 2), dtype=np.int64)
+        flat = buffer.reshape(-1)
+        while True:
+            rows = cur.fetchmany(fetch_size)
+            if not rows:
+                break
+            # Flattening the rows is about 3x faster than assigning the list of row tuples
+            flat[:2 * len(rows)] = np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=2 * len(rows))
+            tracer.count("edges", len(rows))
+            yield buffer[:len(rows)]
+
+    def _write_edgefile(self, query, filename, binary = False, fetch_size = 100000):
+        '''
+        Writes the edges of query as text edge list (one "id1 id2" line per edge, as DistributedNE
+        expects it) or, if binary, as raw native int64 pairs that read_binary_edges can memory-map.
+        '''
+        start = tik()
+        cur = execute(self.connection, query, self.verbose)
+        num_edges = 0
+        with open(filename, "wb") as f:
+            if binary:
+                for batch in self._fetch_edge_batches(cur, fetch_size):
+                    batch.tofile(f)
+                    num_edges += len(batch)
+            else:
+                # Text is formatted from the fetched rows directly, converting them to int64 first costs more than it saves
+                while True:
+                    rows = cur.fetchmany(fetch_size)
+                    if not rows:
+                        break
+                    f.write("".join(f"{row[0]} {row[1]}\n" for row in rows).encode())
+                    num_edges += len(rows)
+                tracer.count("edges", num_edges)
+            num_bytes = f.tell()
+        cur.close()
+        tracer.count("bytes", num_bytes)
+        t = tok(start)
+        print(f"Exported {num_edges} edges ({num_bytes} bytes) in {t:.03f} seconds, {num_edges / max(t, 1e-9):.0f} edges/s")
         self.edgefile = filename
+        self.edgefile_binary = binary
+        return (num_edges, num_bytes)
 
-    def table_to_graph_t_as_v(self, filename):
-        self.partition_multiplier = self._get_partition_multiplier()
+    def table_to_graph_t_as_e(self, filename, binary = False):
+        return self._write_edgefile(self._edge_query_t_as_e(), filename, binary)
 
+    def _edge_subqueries_t_as_v(self):
         tid_normalization = "mod({}, 10000000000000000) + ({} * ({}/10000000000000000))"
+        return [f"select {tid_normalization.format('id1', self.partition_multiplier, 'id1')} as id1, "\
+            f"{tid_normalization.format('id2', self.partition_multiplier, 'id2')} as id2 from ({self._value_group_edges(col)}) t"
+            for col in self.cols]
 
-        q = f"select t1.tid as id1, t2.tid as id2 from {self.table} as t1, {self.table} as t2 " \
-            f"where t1.{self.cols[0]} = t2.{self.cols[0]} and t1.tid < t2.tid "
-        for i in range(1, len(self.cols)):
-            q += f"UNION ALL select t1.tid as id1, t2.tid as id2 from {self.table} as t1, {self.table} as t2 " \
-                f"where t1.{self.cols[i]} = t2.{self.cols[i]} and t1.tid < t2.tid "
+    def _edge_query_t_as_v(self):
+        self.partition_multiplier = self._get_partition_multiplier()
+        return " UNION ALL ".join(self._edge_subqueries_t_as_v())
 
-        query = f"select {tid_normalization.format('id1', self.partition_multiplier, 'id1')} as id1, "\
-            f"{tid_normalization.format('id2', self.partition_multiplier, 'id2')} as id2 from ({q}) t"
+    def _value_group_edges(self, col):
+        '''
+        Edges between the tuples (tids) sharing a value of col, NULLs are not connected.
+        '''
+        if self.sparsify == "star":
+            return f"select m.id as id1, t.tid as id2 from {self.table} as t " \
+                f"INNER JOIN (select {col}, min(tid) as id from {self.table} group by {col}) as m on t.{col} = m.{col} " \
+                f"where t.tid > m.id "
+        if self.sparsify == "chain":
+            return f"select id1, id2 from (select lag(tid) over (partition by {col} order by tid) as id1, tid as id2 " \
+                f"from {self.table} where {col} is not null) t where id1 is not null "
+        return f"select t1.tid as id1, t2.tid as id2 from {self.table} as t1, {self.table} as t2 " \
+            f"where t1.{col} = t2.{col} and t1.tid < t2.tid "
+
+    def table_to_graph_t_as_v(self, filename, binary = False):
+        return self._write_edgefile(self._edge_query_t_as_v(), filename, binary)
+
+    def table_to_edges(self, fetch_size = 100000):
+        '''
+        Runs the edge query of table_to_graph, but returns the edges as int64 arrays (t0, t1) instead of writing an edge file.
+        '''
+        import numpy as np
+        cur = execute(self.connection, self.edge_query(), self.verbose)
+        chunks = [batch.copy() for batch in self._fetch_edge_batches(cur, fetch_size)]
+        cur.close()
+        edges = np.concatenate(chunks) if chunks else np.empty((0, 2), dtype=np.int64)
+        return (edges[:, 0], edges[:, 1])
+
+    def _fetch_edge_shard(self, pool, query, fetch_size, shard_file, span):
+        import numpy as np
+        con = pool.get()
+        try:
+            with tracer.attach(span):
+                cur = execute(con, query, self.verbose)
+                if cur is None:
+                    raise RuntimeError("Edge query failed")
+                if shard_file:
+                    with open(shard_file, "wb") as f:
+                        for batch in self._fetch_edge_batches(cur, fetch_size):
+                            batch.tofile(f)
+                    cur.close()
+                    return shard_file
+                chunks = [batch.copy() for batch in self._fetch_edge_batches(cur, fetch_size)]
+                cur.close()
+                return np.concatenate(chunks) if chunks else np.empty((0, 2), dtype=np.int64)
+        finally:
+            pool.put(con)
+
+    def table_to_edges_client(self, fetch_size = 100000):
+        '''
+        Tuples as edges from a single scan of (tid, key columns), without id mapping tables and joins:
+        The values of each column are dictionary-encoded client-side into dense vertex ids (column i
+        starts after the ids of columns 0..i-1, NULL is a value). Returns the edges as int64 arrays
+        (t0, t1), column pair by column pair in scan order. The id -> value mappings and the vertex ids
+        and tids of all tuples are kept in self.client_graph, so graph_to_table resolves the partitions
+        client-side as well.
+        '''
+        import numpy as np
+        if self.edge_query != self._edge_query_t_as_e:
+            print("Client-side graph construction is only implemented for tuples as edges")
+            return None
+
+        cur = execute(self.connection, f"select tid, {', '.join(self.cols)} from {self.table}", self.verbose)
+        if cur is None:
+            return None
+        encodings = [{} for _ in self.cols]
+        codes = [[] for _ in self.cols]
+        tids = []
+        while True:
+            rows = cur.fetchmany(fetch_size)
+            if not rows:
+                break
+            tids.extend(r[0] for r in rows)
+            tracer.count("rows", len(rows))
+            for i, enc in enumerate(encodings):
+                codes[i].extend([enc.setdefault(r[i + 1], len(enc)) for r in rows])
+        cur.close()
 
-        cur = execute(self.connection, query, self.verbose)
-        f = open(filename, "w")
-        for row in cur:
-            f.write(f"{row[0]} {row[1]}\n")
-        f.close()
-        self.edgefile = filename
+        base = 0
+        ids = np.empty((len(tids), len(self.cols)), dtype=np.int64)
+        for i, enc in enumerate(encodings):
+            ids[:, i] = np.array(codes[i], dtype=np.int64) + base
+            base += len(enc)
+        combs = list(itertools.combinations(range(0,len(self.cols)), 2))
+        self.client_graph = {"tids": np.array(tids, dtype=np.int64), "ids": ids, "combs": combs,
+            "values": [list(enc) for enc in encodings]}
+        return (np.concatenate([ids[:, i] for i, _ in combs]), np.concatenate([ids[:, j] for _, j in combs]))
+
+    def _upload_client_parts(self, parts):
+        '''
+        Resolves the partitions of the tuples of table_to_edges_client from the partitions of their edges with
+        the semantics of _graph_to_table_mapping_table_t_as_e and uploads them with their tids into the temporary table f.
+        '''
+        import numpy as np
+        from edge_loader import bulk_insert
+        graph = self.client_graph
+        parts = np.asarray(parts).reshape(len(graph["combs"]), len(graph["tids"]))
+        # Partitions are resolved per distinct key combination, i.e. per distinct vertex id tuple
+        _, inverse = np.unique(graph["ids"], axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        minpart = np.full(inverse.max() + 1 if len(inverse) else 0, np.iinfo(np.int64).max)
+        maxpart = np.full(len(minpart), -1)
+        np.minimum.at(minpart, inverse, parts.min(axis=0))
+        np.maximum.at(maxpart, inverse, parts.max(axis=0))
+
+        final = minpart.copy()
+        if self.apply:
+            final = np.asarray(self.partition_identifier_mapping, dtype=np.int64)[minpart]
+        exceptions = minpart != maxpart
+        final[exceptions] = np.random.default_rng().integers(-32768, 0, np.count_nonzero(exceptions))
+
+        # tid is the implicit tuple identifier column, so it can not be a column of f
+        q = "DECLARE GLOBAL TEMPORARY TABLE f (t_id BIGINT, part INT) ON COMMIT PRESERVE ROWS WITH NORECOVERY"
+        execute(self.connection, q, self.verbose).close()
+        return bulk_insert(self.connection, "f", (graph["tids"], final[inverse]))
+
+    def _update_table_with_client_parts(self):
+        update_q = f"update {self.table} t from f set t.graph_partition = f.part where t.tid = f.t_id"
+        execute(self.connection, update_q, self.verbose).close()
+
+    def table_to_edges_parallel(self, connect, num_connections, tid_slices = 1, shard_dir = None, fetch_size = 100000):
+        '''
+        Runs the edge query of every column pair (tuples as edges) or key column (tuples as vertices) as separate
+        query on a pool of num_connections connections created by connect(), so the database and the client fetch
+        the edge shards in parallel. For tuples as edges, the id mappings are computed once into tables that all
+        connections read, and with tid_slices > 1 the queries are split into about tid_slices tid ranges, each
+        within one physical partition (a range of tid offsets mod(tid, 10000000000000000)).
+        Returns the edges as int64 arrays (t0, t1) like table_to_edges, or, with shard_dir, the list of
+        binary edge shard files written into shard_dir (see read_binary_edges).
+        '''
+        import queue
+        import numpy as np
+        from concurrent.futures import ThreadPoolExecutor
+
+        start = tik()
+        if self.edge_query == self._edge_query_t_as_e:
+            # The id mappings are also used by graph_to_table, which drops them
+            self._prepare_t_as_e(shared = True)
+            tid_ranges = [None]
+            if tid_slices > 1:
+                cur = execute(self.connection, "select tid/10000000000000000, max(mod(tid, 10000000000000000)) "\
+                    f"from {self.table} group by tid/10000000000000000", self.verbose)
+                physical = cur.fetchall()
+                cur.close()
+                slices = -(-tid_slices // max(1, len(physical)))
+                tid_ranges = []
+                for part, max_off in physical:
+                    base = part * 10000000000000000
+                    step = max_off // slices + 1
+                    tid_ranges += [(base + lo, base + min(lo + step - 1, max_off)) for lo in range(0, max_off + 1, step)]
+            queries = [q for r in tid_ranges for q in self._edge_subqueries_t_as_e(r)]
+        else:
+            self.partition_multiplier = self._get_partition_multiplier()
+            queries = self._edge_subqueries_t_as_v()
+
+        pool = queue.Queue()
+        for _ in range(num_connections):
+            pool.put(connect())
+        shard_files = [os.path.join(shard_dir, f"edges_{i}.bin") if shard_dir else None for i in range(len(queries))]
+        try:
+            with ThreadPoolExecutor(num_connections) as executor:
+                # The pool threads count into the span of the caller
+                span = tracer.current()
+                shards = list(executor.map(lambda a: self._fetch_edge_shard(pool, a[0], fetch_size, a[1], span), zip(queries, shard_files)))
+        finally:
+            while not pool.empty():
+                pool.get().close()
+
+        tok(start, f"### Fetched {len(queries)} edge shards with {num_connections} connections in")
+        if shard_dir:
+            return shards
+        edges = np.concatenate(shards)
+        return (edges[:, 0], edges[:, 1])
 
     def run_partitioning(self, exe_path, options:str = None):
         # Check for DistributedNE executable
@@ -172,6 +419,10 @@ class GraphPartitioner:
             print("Could not find edgefile, please run table_to_graph first")
             return
 
+        if self.edgefile_binary:
+            print("DistributedNE needs a text edgefile, please run table_to_graph without binary")
+            return
+
         option_str = options if options else ""
         cmd = f"mpirun -n {self.partitions} {exe_path} {option_str}"\
             f" {self.edgefile} {self.partitions}"\
@@ -185,110 +436,87 @@ class GraphPartitioner:
 
         return f"{self.edgefile}.{self.partitions}.pedges"
 
-    def _graph_to_table_mapping_table_t_as_e_2_cols(self):
-        num_cols = len(self.cols)
-        combs = list(itertools.combinations(range(0,num_cols), 2))
-        col_list = ", ".join(self.cols)
-
-        dggt_results = "DECLARE GLOBAL TEMPORARY TABLE f as\n"\
-            f"select {col_list}, part from graph_part p " \
-            f"INNER JOIN {self.col_id_mappings[combs[0][0]]} as x on p.t0 = x.id " \
-            f"INNER JOIN {self.col_id_mappings[combs[0][1]]} as y on p.t1 = y.id "
-        
-        for i in range(1, len(combs)):
-            dggt_results += f"UNION ALL select {col_list}, part from graph_part p " \
-                f"INNER JOIN {self.col_id_mappings[combs[i][0]]} as x on p.t0 = x.id " \
-                f"INNER JOIN {self.col_id_mappings[combs[i][1]]} as y on p.t1 = y.id "
-        
-        dggt_results += "\nON COMMIT PRESERVE ROWS WITH NORECOVERY"
-        return dggt_results
-
-    def _graph_to_table_mapping_table_t_as_e_3_cols(self):
+    def run_partitioning_in_process(self, edges, num_workers = 1):
+        '''
+        Partitions the edges (t0, t1) of table_to_edges, or the edge shard files of table_to_edges_parallel,
+        with the built-in neighbour expansion partitioner (see edge_partitioner) instead of DistributedNE, no MPI or edge files needed.
+        Returns the partitioned edges (t0, t1, part) for graph_to_table.
+        '''
+        import numpy as np
+        from edge_partitioner import partition_edges
+        if isinstance(edges, list):
+            # Binary edge shards of table_to_edges_parallel
+            shards = [read_binary_edges(f) for f in edges]
+            edges = (np.concatenate([t0 for t0, _ in shards]), np.concatenate([t1 for _, t1 in shards]))
+        t0, t1 = edges
+        tracer.count("edges", len(t0))
+        return (t0, t1, partition_edges(t0, t1, self.partitions, num_workers))
+
+    def _graph_to_table_mapping_table_t_as_e(self):
+        '''
+        Resolves the partition of every distinct key combination from the partitions of its k-choose-2 edges:
+        The vertex ids of each combination are looked up once (tuple_ids) and graph_part is aggregated to one
+        row per vertex pair (pair_part), as parallel edges of a pair would otherwise multiply the join. Every
+        column pair is then a single join with pair_part, so the work is linear in the number of distinct
+        combinations per pair. Combinations whose edges are in different partitions become exceptions (see _final_part).
+        '''
         num_cols = len(self.cols)
         combs = list(itertools.combinations(range(0,num_cols), 2))
         col_list = ", ".join(self.cols)
-        cum_off = [0]
-        for i in range(1, len(self.cols)): cum_off.append(cum_off[i-1] + self.col_id_offsets[i])
 
-        queries = []
-        for i,x in enumerate(combs):
-            for y in combs[i+1:]:
-                joincols = None
-                p2_datacol = None
-                if (x[0] == y[0]): 
-                    joincols = [0,0]
-                    p2_datacol = 1
-                elif (x[0] == y[1]): 
-                    joincols = [0,1]
-                    p2_datacol = 0
-                elif (x[1] == y[0]): 
-                    joincols = [1,0]
-                    p2_datacol = 1
-                elif (x[1] == y[1]): 
-                    joincols = [1,1]
-                    p2_datacol = 0
-
-                p1_t0_cond = f" between {cum_off[x[0]]} and {cum_off[x[0] + 1]} " if x[0] < num_cols - 1 else f" >= {cum_off[x[0]]}"
-                p1_t1_cond = f" between {cum_off[x[1]]} and {cum_off[x[1] + 1]} " if x[1] < num_cols - 1 else f" >= {cum_off[x[1]]}"
-                p2_t0_cond = f" between {cum_off[y[0]]} and {cum_off[y[0] + 1]} " if y[0] < num_cols - 1 else f" >= {cum_off[y[0]]}"
-                p2_t1_cond = f" between {cum_off[y[1]]} and {cum_off[y[1] + 1]} " if y[1] < num_cols - 1 else f" >= {cum_off[y[1]]}"
-
-                if joincols:
-                    q = f"select {col_list}, CASE WHEN part1=part2 THEN part1 ELSE RANDOM(-32768,-1) END AS part from ("\
-                        f"Select p1.t0 as c0, p1.t1 as c1, p2.t{p2_datacol} as c2, p1.part as part1, p2.part as part2 from graph_part p1, graph_part p2 "\
-                        f"where p1.t0 {p1_t0_cond} and p1.t1 {p1_t1_cond} and p2.t0 {p2_t0_cond} and p2.t1 {p2_t1_cond} "\
-                        f"and p1.t{joincols[0]} = p2.t{joincols[1]}) t "\
-                        f"INNER JOIN {self.col_id_mappings[x[0]]} as x on t.c0 = x.id " \
-                        f"INNER JOIN {self.col_id_mappings[x[1]]} as y on t.c1 = y.id " \
-                        f"INNER JOIN {self.col_id_mappings[y[p2_datacol]]} as z on t.c2 = z.id"
-                    queries.append(q)      
-        q_str = "\n UNION ALL \n".join(queries)
-
-        dggt_results = f"DECLARE GLOBAL TEMPORARY TABLE f as\n select {col_list}, CASE when minpart = maxpart THEN minpart ELSE RANDOM(-32768,-1) END as part from (\n"\
-            f"select {col_list}, min(part) as minpart, max(part) as maxpart from (\n{q_str} \n) t group by {col_list}) t \n ON COMMIT PRESERVE ROWS WITH NORECOVERY"
-        
-        return dggt_results
+        joins = " ".join(f"INNER JOIN {self.col_id_mappings[i]} as x{i} on (t.{c} = x{i}.{c} "
+            f"OR t.{c} is null and x{i}.{c} is null)" for i, c in enumerate(self.cols))
+        id_list = ", ".join(f"x{i}.id as id{i}" for i in range(num_cols))
+        dggt_ids = "DECLARE GLOBAL TEMPORARY TABLE tuple_ids as\n"\
+            f"select {', '.join(f't.{c}' for c in self.cols)}, {id_list} from (select distinct {col_list} from {self.table}) t {joins}"\
+            "\nON COMMIT PRESERVE ROWS WITH NORECOVERY"
 
-    def _load_part_edgefile(self, part_edgefile):
-        if  not os.path.isfile(part_edgefile):
-            print("Could not find partitioned edgefile, please run partitioning first")
-            return False
-        
-        # Check for vwload in path      
-        if not find_in_path("vwload"): 
-            print("Could not find vwload executable")
-            return False
+        dggt_pairs = "DECLARE GLOBAL TEMPORARY TABLE pair_part as\n"\
+            "select t0, t1, min(part) as minpart, max(part) as maxpart from graph_part group by t0, t1"\
+            "\nON COMMIT PRESERVE ROWS WITH NORECOVERY"
 
-        # TODO: Consider using external table
-        execute(self.connection, "Drop table if exists graph_part", self.verbose).close()
-        q = "Create table graph_part(t0 BIGINT, t1 BIGINT, part INT)"
-        execute(self.connection, q, self.verbose).close()
+        all_ids = ", ".join(f"id{i}" for i in range(num_cols))
+        pair_parts = "\n UNION ALL \n".join(f"select {all_ids}, minpart, maxpart from tuple_ids t "
+            f"INNER JOIN pair_part p on p.t0 = t.id{i} and p.t1 = t.id{j}" for i, j in combs)
+        id_cond = " and ".join(f"t.id{i} = g.id{i}" for i in range(num_cols))
+        dggt_results = f"DECLARE GLOBAL TEMPORARY TABLE f as\n select {', '.join(f't.{c}' for c in self.cols)}, {self._final_part()} as part from tuple_ids t LEFT JOIN (\n"\
+            f"select {all_ids}, min(minpart) as minpart, max(maxpart) as maxpart from (\n{pair_parts} \n) t group by {all_ids}) g on {id_cond} \n ON COMMIT PRESERVE ROWS WITH NORECOVERY"
 
-        path, file = os.path.split(part_edgefile)
-        load_q = f"COPY graph_part() VWLOAD FROM '{file}' "\
-            f"WITH FDELIM=' ',insertmode ='Bulk', header, WORK_DIR = '{path}'"
-        execute(self.connection, load_q, self.verbose)
+        return [dggt_ids, dggt_pairs, dggt_results]
 
-        return True
+    def _final_part(self):
+        '''
+        SQL expression for the final graph_partition value from the minimum and maximum partition (minpart, maxpart)
+        of the edges of a tuple: Tuples without edges get a random non-exception identifier, tuples with edges in
+        different partitions a random exception identifier. If the partitioning is applied, the graph partitions
+        0..n-1 are translated with the partition identifier mapping right away.
+        '''
+        final_part = "minpart"
+        if self.apply:
+            whens = " ".join(f"WHEN {i} THEN {ident}" for i, ident in enumerate(self.partition_identifier_mapping))
+            final_part = f"CASE minpart {whens} END"
+        return f"CASE WHEN minpart is null THEN random(1,32000) WHEN minpart = maxpart THEN {final_part} ELSE RANDOM(-32768,-1) END"
 
     def _create_graph_part_col(self):
-        # (Re)create graph_partition column
+        # Adds graph_partition if it is missing. An existing column is overwritten in place,
+        # the updates of graph_to_table write every tuple.
         # TODO: This is dangerous if graph_partition is a user column
-        # TODO: Is it really needed to empty the graph partition column? Simply overwrite...
-        execute(self.connection, f"Modify {self.table} to combine", self.verbose).close()
-        execute(self.connection, f"Alter table {self.table} drop graph_partition restrict", self.verbose, True).close()
+        res = execute(self.connection, f"select graph_partition from {self.table} where 1 = 0", self.verbose, True)
+        exists = res.description is not None
+        res.close()
+        if exists:
+            return True
         res = execute(self.connection, f"Alter table {self.table} add column graph_partition SMALLINT", self.verbose)
         if (res is None):
-            print("Can not (re)create column graph_partition. Is this already the partition key?")
+            print("Can not create column graph_partition.")
             return False
         res.close()
         return True
 
     def _update_table_with_graph_part_t_as_e(self):
-        # Prepare and run the temporary table definition containing the assignments. Currently for 2 or 3 keys.
-        if (len(self.cols) == 2): dggt_results = self._graph_to_table_mapping_table_t_as_e_2_cols()
-        if (len(self.cols) == 3): dggt_results = self._graph_to_table_mapping_table_t_as_e_3_cols()
-        execute(self.connection, dggt_results, self.verbose).close()
+        # Prepare and run the temporary table definitions containing the assignments
+        for dggt in self._graph_to_table_mapping_table_t_as_e():
+            execute(self.connection, dggt, self.verbose).close()
 
         # Prepare and run the update statement
         update_q = f"update {self.table} t from f set t.graph_partition = f.part "\
@@ -298,120 +526,186 @@ class GraphPartitioner:
         
         execute(self.connection, update_q, self.verbose).close()   
 
-        # Tuples without edges never occured in the edge file, because their partition key values only occur once. 
-        # Simply give them a non-exception partition identifier
-        update_q = f"update {self.table} set graph_partition = random(1,32000) where graph_partition is null"
-        execute(self.connection, update_q, self.verbose).close() 
-
     def _update_table_with_graph_part_t_as_v(self):
-        # Prepare and run the temporary table definition containing the assignments. Currently for 2 or 3 keys.
-        dggt_results = f"DECLARE GLOBAL TEMPORARY TABLE f as\n select id, CASE when minpart = maxpart THEN minpart ELSE RANDOM(-32768,-1) END as part from (\n"\
-            f"select id, min(part) as minpart, max(part) as maxpart from (select t0 as id, part from graph_part UNION select t1 as id, part from graph_part) t group by id) t \n ON COMMIT PRESERVE ROWS WITH NORECOVERY"
+        # Prepare and run the temporary table definition containing the assignments.
+        # Tuples without edges never occured in the edge file, because their partition key values only occur once,
+        # the left join keeps them so that a single update writes all tuples.
+        tid_normalization = f"mod(tid, 10000000000000000) + ({self.partition_multiplier} * (tid/10000000000000000))"
+        dggt_results = f"DECLARE GLOBAL TEMPORARY TABLE f as\n select t.id, {self._final_part()} as part from (select {tid_normalization} as id from {self.table}) t LEFT JOIN (\n"\
+            f"select id, min(part) as minpart, max(part) as maxpart from (select t0 as id, part from graph_part UNION select t1 as id, part from graph_part) t group by id) g on t.id = g.id \n ON COMMIT PRESERVE ROWS WITH NORECOVERY"
         execute(self.connection, dggt_results, self.verbose).close()
 
         # Prepare and run the update statement
         update_q = f"update {self.table} t from f set t.graph_partition = f.part where f.id =  mod(t.tid, 10000000000000000) + ({self.partition_multiplier} * (t.tid/10000000000000000))"
         execute(self.connection, update_q, self.verbose).close()   
 
-        # Tuples without edges never occured in the edge file, because their partition key values only occur once. 
-        # Simply give them a non-exception partition identifier
-        update_q = f"update {self.table} set graph_partition = random(1,32000) where graph_partition is null"
-        execute(self.connection, update_q, self.verbose).close() 
+    def graph_to_table(self, part_edges):
+        '''
+        part_edges: The partitioned edge file of run_partitioning, a binary partitioned edge file or the partitioned
+            edges of run_partitioning_in_process. They are loaded into graph_part with self.loader (see edge_loader).
+        '''
+        from edge_loader import default_loader
+        # Partitions of the edges of table_to_edges_client are resolved client-side, without graph_part
+        client_side = self.client_graph is not None and not isinstance(part_edges, str)
+        if not client_side:
+            loader = self.loader if self.loader else default_loader(self.connection)
+            if not loader.load(self.connection, part_edges, self.verbose):
+                return False
+
+        return self._graph_part_to_table(part_edges[2] if client_side else None)
 
-    def graph_to_table(self, part_edgefile):
-        if not self._load_part_edgefile(part_edgefile):
+    def _graph_part_to_table(self, client_parts = None):
+        '''
+        Writes graph_partition from the loaded graph_part table, or from the edge partitions of table_to_edges_client.
+        '''
+        # The identifier mapping is applied while writing graph_partition, see _final_part
+        if self.apply:
+            self._create_partition_identifier_mapping()
+
+        # graph_partition is only touched once the partitions are uploaded
+        if client_parts is not None and not self._upload_client_parts(client_parts):
             return False
 
         if not self._create_graph_part_col():
             return False
         
+        if client_parts is not None:
+            self._update_table_with_client_parts()
+            commit(self.connection)
+            self.graph_part_translated = self.apply
+            return True
+
         self.update_table_with_graph_part()
         
         # Cleanup and commit
         execute(self.connection, "Drop table graph_part", self.verbose).close()
+        self._drop_shared_id_mappings()
         commit(self.connection)
+        self.graph_part_translated = self.apply
 
         return True
 
-    def _apply_partition_identifier_mapping(self):
+    def run_streaming(self, num_workers = 1, fetch_size = 100000, load_batch = 100000, queue_size = 64):
         '''
-        Replace graph partition identifiers 0..n-1 to identifiers that lead to a 
-        balanced hash partitioning.
+        Runs edge export, built-in partitioning and loading of graph_part followed by graph_to_table, with a streamed load:
+        The partitioner needs the complete graph to relabel the vertices and build its CSR, so the edges are exported
+        first, without overlap. Then a loader thread inserts the edges into graph_part as soon as the partitioner assigns
+        them (assignments are final, see edge_partitioner.partition_edges), so partitioning and loading overlap.
+        Busy and idle time of every stage is reported.
         '''
-        import time
+        import queue
+        import threading
+        import numpy as np
+        from edge_loader import bulk_insert
+        from edge_partitioner import partition_edges
+        from timing import StageTimer, print_stage_times
 
-        assert(self.partition_identifier_mapping is not None)
+        export, partition, load = StageTimer("export"), StageTimer("partition"), StageTimer("load")
+        wall = tik()
+        errors = []
+
+        start = tik()
+        try:
+            cur = execute(self.connection, self.edge_query(), self.verbose)
+            if cur is None:
+                raise RuntimeError("Edge query failed")
+            # The fetched batches are views of one buffer
+            chunks = [batch.copy() for batch in self._fetch_edge_batches(cur, fetch_size)]
+            cur.close()
+        except Exception as e:
+            print(f"Edge export failed. Reason: {e}")
+            return False
+        export.add_busy(start)
+
+        assigned = queue.Queue(queue_size)
+        def loader():
+            try:
+                start = tik()
+                execute(self.connection, "Drop table if exists graph_part", self.verbose).close()
+                execute(self.connection, "Create table graph_part(t0 BIGINT, t1 BIGINT, part INT)", self.verbose).close()
+                load.add_busy(start)
+            except Exception as e:
+                errors.append(e)
+            pending = []
+            while True:
+                start = tik()
+                item = assigned.get()
+                load.add_idle(start)
+                if item is not None:
+                    pending.append(item)
+                if pending and (item is None or sum(len(p[2]) for p in pending) >= load_batch):
+                    start = tik()
+                    # Keep draining after failures, the partitioner must not block on a full queue
+                    if not errors and not bulk_insert(self.connection, "graph_part",
+                            [np.concatenate([p[i] for p in pending]) for i in range(3)]):
+                        errors.append(RuntimeError("Loading graph_part failed"))
+                    pending = []
+                    load.add_busy(start)
+                if item is None:
+                    break
+
+        start = tik()
+        edges = np.concatenate(chunks) if chunks else np.empty((0, 2), dtype=np.int64)
+        t0, t1 = edges[:, 0], edges[:, 1]
+        load_thread = threading.Thread(target=tracer.wrap(loader), daemon=True)
+        load_thread.start()
+        waited = 0.0
+        def on_assigned(edge_ids, part):
+            nonlocal waited
+            put_start = tik()
+            assigned.put((t0[edge_ids], t1[edge_ids], np.full(len(edge_ids), part, dtype=np.int64)))
+            waited += tik() - put_start
+        try:
+            partition_edges(t0, t1, self.partitions, num_workers, on_assigned = on_assigned)
+        finally:
+            assigned.put(None)
+        partition.busy += tok(start) - waited
+        partition.idle += waited
+        start = tik()
+        load_thread.join()
+        partition.add_idle(start)
+        print_stage_times([export, partition, load], tok(wall))
+        for stage in (export, partition, load):
+            tracer.record(stage.name, stage.busy, idle_seconds = round(stage.idle, 3))
+        if errors:
+            print(f"Loading the partitioned edges failed. Reason: {errors[0]}")
+            return False
 
-        time.sleep(self.waittime)
-        for i in range(len(self.partition_identifier_mapping)):
-            execute(self.connection, f"Update {self.table} set graph_partition = {self.partition_identifier_mapping[i]} "\
-            f"where graph_partition = {i}", self.verbose)\
-            .close()  
+        return self._graph_part_to_table()
 
     def apply_partitioning(self):
-        self._create_partition_identifier_mapping()
-        self._apply_partition_identifier_mapping()
-        
+        '''
+        Reconstructs the table hash partitioned on graph_partition. graph_to_table fills it with the balanced
+        partition identifiers if self.apply is set, otherwise the graph partitions 0..n-1 are translated here first.
+        Returns False if graph_partition was not written by graph_to_table.
+        '''
+        import time
+
+        if self.graph_part_translated is None:
+            print("graph_partition is not written yet, please run graph_to_table first")
+            return False
+        if not self.graph_part_translated:
+            if self.partition_identifier_mapping is None:
+                self._create_partition_identifier_mapping()
+            whens = " ".join(f"WHEN {i} THEN {ident}" for i, ident in enumerate(self.partition_identifier_mapping))
+            q = f"update {self.table} set graph_partition = CASE graph_partition {whens} ELSE graph_partition END"
+            execute(self.connection, q, self.verbose).close()
+            commit(self.connection)
+            self.graph_part_translated = True
+
+        with tracer.span("wait"):
+            time.sleep(self.waittime)
         q = f"Modify {self.table} to reconstruct with partition="\
             f"(hash on graph_partition {self.partitions} partitions)"
         execute(self.connection, q, self.verbose).close()
         commit(self.connection)
+        return True
 
     def print_statistics(self):
-        print(f"\nTable: {self.table}\nColumns: {self.cols})")
-        cur = execute(self.connection, f"Select count(*) from {self.table}")
-        total_tuples = cur.fetchone()[0]
-        cur.close()
-        print(f"Total tuples: {total_tuples}")
-
-        for col in self.cols:
-            cur = execute(self.connection, f"Select count(distinct {col}) from {self.table}")
-            t = cur.fetchone()[0]
-            cur.close()
-            print(f"Distinct values of {col}: {t}")
-
-        for col in self.cols:
-            cur = execute(self.connection, f"select count(*) from {self.table} where {col} in "\
-                f"(select {col} from {self.table} group by 1 having count(distinct graph_partition)>1)")
-            num_exceptions = cur.fetchone()[0]
-            cur.close()
-            print(f"Exception rate in column {col}: {(num_exceptions/total_tuples) * 100:6.3f}%")
-        
-        equal_part_size = total_tuples / self.partitions
-
-        cur = execute(self.connection, f"select max(cnt) from ("\
-            f"select graph_partition, count(*) as cnt from {self.table} "\
-            f"group by 1) as t")
-        max_graph_part = cur.fetchone()[0]
-        cur.close()
-
-        cur = execute(self.connection, f"select min(cnt) from ("\
-            f"select graph_partition, count(*) as cnt from {self.table} "\
-            f" group by 1) as t")
-        min_graph_part = cur.fetchone()[0]
-        cur.close()
-
-        print(f"Graph partition sizes:\n"\
-            f" Min: {min_graph_part} ({(min_graph_part - equal_part_size) / equal_part_size * 100:+6.3f}% from balanced partitioning)\n"\
-            f" Max: {max_graph_part} ({(max_graph_part - equal_part_size) / equal_part_size * 100:+6.3f}% from balanced partitioning)\n")
-
-        if (self.apply):
-            cur = execute(self.connection, f"select max(cnt) from ("\
-                f"select tid/10000000000000000, count(*) as cnt from {self.table} "\
-                f"group by 1) as t")
-            max_actual_part = cur.fetchone()[0]
-            cur.close()
-
-            cur = execute(self.connection, f"select min(cnt) from ("\
-                f"select tid/10000000000000000, count(*) as cnt from {self.table} "\
-                f"group by 1) as t")
-            min_actual_part = cur.fetchone()[0]
-            cur.close()
-
-            print(f"Actual partition sizes:\n"\
-                f" Min: {min_actual_part} ({(min_actual_part - equal_part_size) / equal_part_size * 100:+6.3f}% from balanced partitioning)\n"\
-                f" Max: {max_actual_part} ({(max_actual_part - equal_part_size) / equal_part_size * 100:+6.3f}% from balanced partitioning)\n")
-            
+        from partition_statistics import collect_statistics
+        stats = collect_statistics(self.connection, self.table, self.cols)
+        if stats is not None:
+            stats.print(self.partitions, physical=self.apply)
 
     def reset_partitioning(self):
         q = f"Modify {self.table} to reconstruct with partition="\
@@ -419,25 +713,59 @@ class GraphPartitioner:
         execute(self.connection, q, self.verbose).close()
         commit(self.connection)
 
-    def run(self, graph_file, distributedNE_bin):
-        start = tik()   
-        self.table_to_graph(graph_file)
-        tok(start, "### Table to graph runtime:")
-        start = tik()
-        part_edgefile = self.run_partitioning(distributedNE_bin)
-        if not part_edgefile:
-            print("Calling the partitioner failed. Exiting.")
-            exit()
-        tok(start, "### Run partitioning runtime:")
-        start = tik()
-        if not self.graph_to_table(part_edgefile): 
-            tok(start,"### Graph to table failed after")
-            return
-        tok(start, "### Graph to table runtime:")
-        if self.apply: 
-            start = tik()
-            self.apply_partitioning()
-            tok(start, "### Apply partitioning runtime:")
-        if self.print_stats:
-            self.print_statistics()
-        os.remove(graph_file)
\ No newline at end of file
+    def run(self, graph_file, distributedNE_bin = None, num_workers = 1, client_side = False, streaming = False):
+        '''
+        Without distributedNE_bin, the built-in edge partitioner is used with num_workers processes
+        and graph_file is not needed. With client_side, the graph is constructed from a single table
+        scan (see table_to_edges_client), with streaming graph_part is loaded while the edges are
+        partitioned (see run_streaming). The stages are recorded as spans of timing.tracer.
+        Returns False if a stage failed.
+        '''
+        with tracer.span("run"):
+            if streaming and not distributedNE_bin and not client_side:
+                with tracer.span("streaming") as s:
+                    ok = self.run_streaming(num_workers)
+                if not ok:
+                    print(f"### Streaming graph partitioning failed after {s.seconds:.03f} seconds")
+                    return False
+                print(f"### Streaming graph partitioning runtime: {s.seconds:.03f} seconds")
+            else:
+                if not self._run_stages(graph_file, distributedNE_bin, num_workers, client_side):
+                    return False
+            if self.apply: 
+                with tracer.span("apply_partitioning", "### Apply partitioning runtime:"):
+                    if not self.apply_partitioning():
+                        return False
+            if self.print_stats:
+                with tracer.span("print_statistics"):
+                    self.print_statistics()
+        if distributedNE_bin:
+            os.remove(graph_file)
+        return True
+
+    def _run_stages(self, graph_file, distributedNE_bin, num_workers, client_side):
+        with tracer.span("table_to_graph", "### Table to graph runtime:"):
+            if distributedNE_bin:
+                self.table_to_graph(graph_file)
+            elif client_side:
+                edges = self.table_to_edges_client()
+            else:
+                edges = self.table_to_edges()
+        if not distributedNE_bin and edges is None:
+            print("Constructing the graph failed.")
+            return False
+        with tracer.span("run_partitioning", "### Run partitioning runtime:"):
+            if distributedNE_bin:
+                part_edges = self.run_partitioning(distributedNE_bin)
+            else:
+                part_edges = self.run_partitioning_in_process(edges, num_workers)
+        if part_edges is None:
+            print("Calling the partitioner failed.")
+            return False
+        with tracer.span("graph_to_table") as s:
+            ok = self.graph_to_table(part_edges)
+        if not ok:
+            print(f"### Graph to table failed after {s.seconds:.03f} seconds")
+            return False
+        print(f"### Graph to table runtime: {s.seconds:.03f} seconds")
+        return True
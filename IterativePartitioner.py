@@ -1,7 +1,21 @@
+from partition_writer import PartitionFileWriter, shard_filenames
+from streaming_statistics import StreamingStatistics
+from identifier_mapping_cache import get_identifier_mapping
+from timing import tracer, traced
+
 class IterativePartitioner:
-    from identifier_mapping_dict import partition_identifier_mapping_dict as id_map
     EXCEPTION_MARKER = -1
     UNKNOWN_OFFSET = -1
+    # Marks key values without mapping in the array-based batch assignment
+    UNMAPPED_MARKER = -2
+    MIN_BATCH_WINDOW = 64
+    # Average hashed/counted segment length below which a run is counted tuple by tuple
+    MIN_SEGMENT_LENGTH = 32
+    # Adaptive insert batch sizes of load_table_from_file
+    MIN_INSERT_BATCH = 1000
+    MAX_INSERT_BATCH = 100000
+    TARGET_INSERT_LATENCY = 0.5
+    SNAPSHOT_CHUNK = 1000000
 
     class Table:
         name = None
@@ -39,21 +53,52 @@ class IterativePartitioner:
             self.pk_table = pk_table
             self.pk_col = pk_col
 
-    def __init__(self, con, num_partitions, trace_partitions = False):
+    class DimRoute:
+        '''
+        Precompiled routing of a dimension table along one foreign key: the key column offset in
+        the dimension tuples and the mapping of the referencing fact key.
+        '''
+        fk_off = None
+        dim_key_off = None
+        key_idx = None
+
+        def __init__(self, fk_off, dim_key_off, key_idx):
+            self.fk_off = fk_off
+            self.dim_key_off = dim_key_off
+            self.key_idx = key_idx
+
+    def __init__(self, con, num_partitions, trace_partitions = False, mapping_store = None, collect_statistics = False):
+        '''
+        mapping_store: Class used for the key value -> partition mapping of each key, called with the
+            partition identifier mapping and the exception marker (e.g. mapping_store.CompactKeyMapping).
+            Plain dicts are used if not given.
+        collect_statistics: Maintain StreamingStatistics for print_statistics without tracing all key values.
+            Its tuple counters are kept in the mappings, so mapping_store defaults to CompactKeyMapping then.
+        '''
         self.last_choice = 0
         self.con = con
         self.num_partitions = num_partitions
-        self.part_id_map = self.id_map[self.num_partitions]
+        # Partition counts without built-in mapping are probed on con once and cached
+        self.part_id_map = get_identifier_mapping(self.num_partitions, con)
         assert self.part_id_map != None, "Partition identifier mapping does not exist"
         self.trace_partitions = trace_partitions
         self.partition_counts = [0] * num_partitions
+        if collect_statistics and mapping_store is None:
+            from mapping_store import CompactKeyMapping
+            mapping_store = CompactKeyMapping
+        self.mapping_store = mapping_store
         self.mappings = []
         self.partitions = []
         self.key_map = []
         self.num_keys = 0
         self.tables = []
         self.fks = []
+        # Dimension table name -> DimRoute of each foreign key referencing it, in declaration order
+        self.dim_routes = {}
         self.time = 0.0
+        self.insert_stats = None
+        self.insert_thread = None
+        self.statistics = StreamingStatistics(self.part_id_map, self.EXCEPTION_MARKER) if collect_statistics else None
 
     def _run_query(self, query, should_print = True):
         cursor = self.con.cursor()
@@ -87,77 +132,293 @@ class IterativePartitioner:
                 return i
         return self.UNKNOWN_OFFSET
 
-    def _get_fk_off_by_pk_table(self, pk_table):
-        for i, t in enumerate(self.fks):
-            if t.pk_table == pk_table:
-                return i
-        return self.UNKNOWN_OFFSET
+    def _new_mapping(self):
+        if self.mapping_store is None:
+            return {}
+        return self.mapping_store(self.part_id_map, self.EXCEPTION_MARKER)
 
-    def _hash_fact(self, row):
+    def _hash_fact(self):
         part = self.partition_counts.index(min(self.partition_counts))
         return (part, self.part_id_map[part])
 
+    def _hash_facts(self, num_tuples):
+        '''
+        Bulk variant of _hash_fact: assigns num_tuples tuples one after the other to the partition with
+        the lowest count, the first one on ties. Returns their partition offsets in order.
+        '''
+        import numpy as np
+        counts = np.array(self.partition_counts, dtype=np.int64)
+        # The k-th tuple takes the k-th smallest free slot (level, offset), partition i has slots at levels counts[i], counts[i]+1, ...
+        low, high = int(counts.min()), int(counts.min()) + num_tuples
+        while low < high:
+            level = (low + high + 1) // 2
+            if np.maximum(level - counts, 0).sum() <= num_tuples:
+                low = level
+            else:
+                high = level - 1
+        below = np.maximum(low - counts, 0)
+        rest = np.flatnonzero(counts <= low)[:num_tuples - int(below.sum())]
+        offs = np.concatenate([np.repeat(np.arange(len(counts)), below), rest])
+        levels = np.concatenate([np.concatenate([np.arange(c, low) for c in counts]).astype(np.int64),
+            np.full(len(rest), low, dtype=np.int64)])
+        offs = offs[np.lexsort((offs, levels))]
+        counts += np.bincount(offs, minlength=len(counts))
+        self.partition_counts = counts.tolist()
+        return offs
+
+    def _count_run(self, part_offs, hashed):
+        '''
+        Counts a run of tuples in tuple order. part_offs holds their partition offsets, the offsets of
+        the tuples marked in hashed are filled in with the decision _hash_fact takes at their position.
+        '''
+        import numpy as np
+        bounds = (np.flatnonzero(hashed[1:] != hashed[:-1]) + 1).tolist()
+        if len(bounds) * self.MIN_SEGMENT_LENGTH > len(part_offs):
+            # Short alternating segments, counting tuple by tuple is cheaper than per segment
+            offs = part_offs.tolist()
+            counts = self.partition_counts
+            for i, h in enumerate(hashed.tolist()):
+                if h:
+                    offs[i] = counts.index(min(counts))
+                counts[offs[i]] += 1
+            part_offs[:] = offs
+            return
+        for start, end in zip([0] + bounds, bounds + [len(part_offs)]):
+            if hashed[start]:
+                part_offs[start:end] = self._hash_facts(end - start)
+                continue
+            counts = np.bincount(part_offs[start:end], minlength=self.num_partitions)
+            for part_off in np.flatnonzero(counts):
+                self.partition_counts[part_off] += int(counts[part_off])
+
     def _hash_dim(self, row, key_idx):
         part = hash(row[key_idx]) % self.num_partitions
         return (part, self.part_id_map[part])
 
-    def _get_dim_partition(self, row, fact_key_off, dim_key_off):
-        part = self.mappings[fact_key_off].get(row[dim_key_off])
-        #if (part == self.EXCEPTION_MARKER):
-        #    print(f"Value {row[dim_key_off]} is an exception")
-        if part == self.EXCEPTION_MARKER or part == None:
-            part = row[dim_key_off]
-        return part
+    def _get_dim_partitions(self, routes, rows):
+        '''
+        Routes a batch of dimension tuples along the compiled routes of their table. A tuple goes to
+        the partition of the first foreign key whose mapping maps its key value, exceptions and
+        unreferenced key values are hash partitioned on the key value itself.
+        '''
+        parts = [None] * len(rows)
+        for route in routes:
+            # One pass over the key column per route instead of per tuple name resolution
+            lookups = map(self.mappings[route.key_idx].get, [row[route.dim_key_off] for row in rows])
+            parts = [l if p is None and l != self.EXCEPTION_MARKER else p for p, l in zip(parts, lookups)]
+        dim_key_off = routes[0].dim_key_off
+        return [row[dim_key_off] if p is None else p for row, p in zip(rows, parts)]
+
+    def _resolve_fact_lookups(self, lookups):
+        '''
+        Decides the partition of a fact tuple from the mapping lookups of its key values.
+        Returns the partition offset, the partition identifier and, per key, the new mapping
+        of the key value (None if the mapping stays unchanged).
+        '''
+        updates = [None] * self.num_keys
+
+        # All lookups are None or Exceptions, so no decicion enforced for this tuple
+        if lookups.count(None) + lookups.count(self.EXCEPTION_MARKER) == len(lookups):
+            part_off, part = self._hash_fact()
+            for cnt, l in enumerate(lookups):
+                if l is None:
+                    updates[cnt] = part
+            return (part_off, part, updates)
+
+        # We need to derive the partition from the already observed tuples
+        part = None
+        for l in lookups:
+            # Get the first assignment in the list
+            if l is not None and l != self.EXCEPTION_MARKER and part is None:
+                part = l
+            # If we encounter a second, different assignment in list, 
+            # we enforce partitioning according to one column value, making the other to exceptions.
+            # The chosen column varies in round robin manner to balance exceptions on all columns
+            elif l is not None and l != self.EXCEPTION_MARKER and l != part:
+                choice = (self.last_choice + 1) % self.num_keys
+                # We have at least two different part_ids, so it is ensured that this is no infinite loop
+                while lookups[choice] is None or lookups[choice] == self.EXCEPTION_MARKER:
+                    choice = (choice + 1) % self.num_keys
+                part = lookups[choice]
+                self.last_choice = choice
+                break
+        
+        # Now actually 
+        for cnt, l in enumerate(lookups):
+            # Co-partition if no assignment yet
+            if l is None: 
+                updates[cnt] = part
+            # If there is an assignment that differs from the chosen one, the column value
+            # is now an exception
+            elif l != part and l != self.EXCEPTION_MARKER:
+                updates[cnt] = self.EXCEPTION_MARKER
+        return (self.part_id_map.index(part), part, updates)
 
     def _get_fact_partition(self, row):
         lookups = [None] * self.num_keys
         for cnt, idx in enumerate(self.key_map):
             lookups[cnt] = self.mappings[cnt].get(row[idx])
 
-        # All lookups are None or Exceptions, so no decicion enforced for this tuple
-        if lookups.count(None) + lookups.count(self.EXCEPTION_MARKER) == len(lookups):
-            part_off, part = self._hash_fact(row)
-            for cnt, idx in enumerate(self.key_map):
-                if lookups[cnt] is None:
-                    self.mappings[cnt][row[idx]] = part
-
-        # We need to derive the partition from the already observed tuples
-        else:
-            part = None
-            for l in lookups:
-                # Get the first assignment in the list
-                if l is not None and l != self.EXCEPTION_MARKER and part is None:
-                    part = l
-                # If we encounter a second, different assignment in list, 
-                # we enforce partitioning according to one column value, making the other to exceptions.
-                # The chosen column varies in round robin manner to balance exceptions on all columns
-                elif l is not None and l != self.EXCEPTION_MARKER and l != part:
-                    choice = (self.last_choice + 1) % self.num_keys
-                    # We have at least two different part_ids, so it is ensured that this is no infinite loop
-                    while lookups[choice] is None or lookups[choice] == self.EXCEPTION_MARKER:
-                        choice = (choice + 1) % self.num_keys
-                    part = lookups[choice]
-                    self.last_choice = choice
-                    break
-            
-            # Now actually 
-            for cnt, l in enumerate(lookups):
-                # Co-partition if no assignment yet
-                if l is None: 
-                    self.mappings[cnt][row[self.key_map[cnt]]] = part
-                # If there is an assignment that differs from the chosen one, the column value
-                # is now an exception
-                elif l != part:
-                    self.mappings[cnt][row[self.key_map[cnt]]] = self.EXCEPTION_MARKER
-            part_off = self.part_id_map.index(part)
+        part_off, part, updates = self._resolve_fact_lookups(lookups)
+        for cnt, u in enumerate(updates):
+            if u is not None:
+                self.mappings[cnt][row[self.key_map[cnt]]] = u
 
         if self.trace_partitions:
             for cnt, idx in enumerate(self.key_map):
                 self.partitions[cnt][part_off].append(row[idx])
+        if self.statistics is not None:
+            self.statistics.add_tuple(self.mappings, part_off, lookups, updates, [row[idx] for idx in self.key_map])
 
         self.partition_counts[part_off] += 1
         return part
 
+    def encode_key_columns(self, rows):
+        '''
+        Dictionary-encodes the partition key columns of rows for get_fact_partitions.
+        '''
+        import numpy as np
+        key_codes = []
+        key_dicts = []
+        for idx in self.key_map:
+            # Codes in order of first occurrence, a dictionary is faster than sorting the values
+            codes = {}
+            key_codes.append(np.fromiter((codes.setdefault(r[idx], len(codes)) for r in rows), dtype=np.int64, count=len(rows)))
+            key_dicts.append(list(codes))
+        return (key_codes, key_dicts)
+
+    def _part_off_lookup_table(self):
+        import numpy as np
+        lut = np.full(max(self.part_id_map) + 1, self.UNKNOWN_OFFSET, dtype=np.int64)
+        lut[self.part_id_map] = np.arange(self.num_partitions)
+        return lut
+
+    def _classify_fact_lookups(self, lookups):
+        '''
+        Classifies a window of tuples by lookups (one row of mapping states per key).
+        Returns per tuple the partition identifier of its mapped key values (valid for tuples without
+        conflict), a mask of the tuples without mapped key value, which need a hash decision, and a mask of
+        the tuples whose mapped key values disagree, which are resolved as in _resolve_fact_lookups.
+        '''
+        import numpy as np
+        valid = (lookups != self.UNMAPPED_MARKER) & (lookups != self.EXCEPTION_MARKER)
+        lowest = np.where(valid, lookups, np.iinfo(np.int64).max).min(axis=0)
+        highest = np.where(valid, lookups, self.UNMAPPED_MARKER).max(axis=0)
+        hashed = ~valid.any(axis=0)
+        conflicts = ~hashed & (lowest != highest)
+        return (highest, hashed, conflicts, valid)
+
+    def _round_robin_choices(self, valid):
+        '''
+        Returns for a sequence of conflicting tuples (columns of valid, which marks their mapped key values)
+        the key chosen by _resolve_fact_lookups, which is the next mapped key after the previous choice.
+        '''
+        choices = []
+        choice = self.last_choice
+        for mask in valid.T.tolist():
+            choice = (choice + 1) % self.num_keys
+            while not mask[choice]:
+                choice = (choice + 1) % self.num_keys
+            choices.append(choice)
+        self.last_choice = choice
+        return choices
+
+    def get_fact_partitions(self, key_codes, key_dicts):
+        '''
+        Batched variant of _get_fact_partition. key_codes holds one dictionary-encoded NumPy array
+        per partition key (in the order the keys were added), key_dicts the values the codes refer to.
+        Tuples are assigned in runs with array operations, where each tuple of a run sees the mappings
+        at the start of the run.
+        Returns the partition identifiers of all tuples. The result, mappings, partition counts and
+        partitions are identical to calling _get_fact_partition row by row.
+        '''
+        import numpy as np
+        from itertools import repeat
+        num_rows = len(key_codes[0]) if key_codes else 0
+        if self.num_keys == 0:
+            return np.array([self._get_fact_partition([]) for _ in range(num_rows)], dtype=np.int64)
+        result = np.empty(num_rows, dtype=np.int64)
+        key_dicts = [d.tolist() if isinstance(d, np.ndarray) else list(d) for d in key_dicts]
+        key_codes = [np.asarray(c, dtype=np.int64) for c in key_codes]
+        states = [np.fromiter(map(self.mappings[cnt].get, d, repeat(self.UNMAPPED_MARKER)), dtype=np.int64, count=len(d))
+            for cnt, d in enumerate(key_dicts)]
+        # Per key and code the first position in the current window at which the mapping changes
+        first_change = [np.full(len(d), num_rows, dtype=np.int64) for d in key_dicts]
+        part_off_lut = self._part_off_lookup_table()
+        part_ids = np.array(self.part_id_map, dtype=np.int64)
+
+        pos = 0
+        window = self.MIN_BATCH_WINDOW
+        while pos < num_rows:
+            end = min(num_rows, pos + window)
+            codes = [c[pos:end] for c in key_codes]
+            lookups = np.stack([states[cnt][c] for cnt, c in enumerate(codes)])
+            parts, hashed, conflicts, valid = self._classify_fact_lookups(lookups)
+
+            # Unmapped values and the mapped values of conflicting tuples get new mappings in the run,
+            # so the run has to stop at the next occurrence of such a value
+            run = end - pos
+            changing = (lookups == self.UNMAPPED_MARKER) | (valid & conflicts)
+            for cnt, c in enumerate(codes):
+                change_pos = np.flatnonzero(changing[cnt])
+                if len(change_pos) == 0:
+                    continue
+                changed, first = np.unique(c[change_pos], return_index=True)
+                first_change[cnt][changed] = change_pos[first]
+                stale = np.flatnonzero(first_change[cnt][c] < np.arange(len(c)))
+                first_change[cnt][changed] = num_rows
+                if len(stale) > 0:
+                    run = min(run, int(stale[0]))
+
+            lookups = lookups[:, :run]
+            hashed = hashed[:run]
+            conflicts = conflicts[:run]
+            part_offs = part_off_lut[np.where(hashed, self.part_id_map[0], parts[:run])]
+            conflict_pos = np.flatnonzero(conflicts)
+            if len(conflict_pos) > 0:
+                # As in _resolve_fact_lookups, the mapping of a round robin chosen key wins
+                choices = self._round_robin_choices(valid[:, conflict_pos])
+                chosen = lookups[choices, conflict_pos]
+                part_offs[conflict_pos] = part_off_lut[chosen]
+                # The other mapped values of conflicting tuples become exceptions
+                exceptions = valid[:, conflict_pos] & (lookups[:, conflict_pos] != chosen)
+            self._count_run(part_offs, hashed)
+            parts = part_ids[part_offs]
+            result[pos:pos + run] = parts
+
+            for cnt, c in enumerate(codes):
+                c = c[:run]
+                values = key_dicts[cnt]
+                mapping = self.mappings[cnt]
+                # Changed values occur once in the run, so they are written to the mapping item-wise
+                new_pos = np.flatnonzero(lookups[cnt] == self.UNMAPPED_MARKER)
+                states[cnt][c[new_pos]] = parts[new_pos]
+                for v, part in zip(c[new_pos].tolist(), parts[new_pos].tolist()):
+                    mapping[values[v]] = part
+                if len(conflict_pos) > 0:
+                    exception_codes = c[conflict_pos[exceptions[cnt]]]
+                    states[cnt][exception_codes] = self.EXCEPTION_MARKER
+                    for v in exception_codes.tolist():
+                        mapping[values[v]] = self.EXCEPTION_MARKER
+                if self.trace_partitions:
+                    for part_off in np.unique(part_offs):
+                        self.partitions[cnt][part_off].extend(values[v] for v in c[part_offs == part_off])
+            if self.statistics is not None:
+                plain = ~conflicts
+                self.statistics.add_tuples(self.mappings, part_offs[plain], [c[:run][plain] for c in codes], key_dicts,
+                    list(lookups[:, plain] == self.EXCEPTION_MARKER), list(lookups[:, plain] == self.UNMAPPED_MARKER))
+                for j, i in enumerate(conflict_pos.tolist()):
+                    l = [None if x == self.UNMAPPED_MARKER else x for x in lookups[:, i].tolist()]
+                    updates = [self.EXCEPTION_MARKER if e else (int(chosen[j]) if x is None else None)
+                        for x, e in zip(l, exceptions[:, j].tolist())]
+                    self.statistics.add_tuple(self.mappings, int(part_offs[i]), l, updates,
+                        [key_dicts[cnt][int(c[i])] for cnt, c in enumerate(codes)])
+
+            pos += run
+            window = window * 2 if pos == end else max(self.MIN_BATCH_WINDOW, run)
+
+        return result
+
     def _create_table(self, table_off):
         assert(table_off < len(self.tables))
         t = self.tables[table_off]
@@ -237,7 +498,10 @@ class IterativePartitioner:
 
         self.key_map.append(fk_col_off)
         self.num_keys += 1
-        self.mappings.append({})
+        self.dim_routes.setdefault(pk_table, []).append(self.DimRoute(len(self.fks) - 1, pk_col_off, self.num_keys - 1))
+        self.mappings.append(self._new_mapping())
+        if self.statistics is not None:
+            self.statistics.add_key()
         if self.trace_partitions:
             self.partitions.append([])
             for p in range(self.num_partitions):
@@ -257,47 +521,90 @@ class IterativePartitioner:
 
         self.key_map.append(col_off)
         self.num_keys += 1
-        self.mappings.append({})
+        self.mappings.append(self._new_mapping())
+        if self.statistics is not None:
+            self.statistics.add_key()
         if self.trace_partitions:
             self.partitions.append([])
             for p in range(self.num_partitions):
                 self.partitions[len(self.partitions) - 1].append([])
 
-    def insert_fact_rows(self, tablename, rows):
-        t_off = self._get_table_off_by_name(tablename) 
-        if t_off == self.UNKNOWN_OFFSET:
-            print(f"Table {tablename} does not exist")
-            return
-
-        inserts = []
-        for r in rows:
-            for i in self.tables[t_off].string_col_offs:
-                r[i] = f"'{r[i]}'"
-            r.append(self._get_fact_partition(r))
-            inserts.append(f"({','.join(str(x) for x in r)})")
+    def _insert_rows(self, tablename, rows):
+        # Parameterized bulk insert, pyodbc binds all rows as parameter arrays with fast_executemany
         import time
         start = time.perf_counter()
-        self._run_update_query(f"Insert into {tablename} values {','.join(inserts)}")
+        cursor = self.con.cursor()
+        if hasattr(cursor, "fast_executemany"):
+            cursor.fast_executemany = True
+        cursor.executemany(f"Insert into {tablename} values ({','.join(['?'] * len(rows[0]))})", rows)
+        self.con.commit()
+        cursor.close()
         end = time.perf_counter()
         self.time += end - start
+        self.insert_stats = (len(rows), end - start)
+        tracer.count("queries", 2)
+        tracer.count("rows", len(rows))
+
+    def _insert_worker(self):
+        while True:
+            item = self.insert_queue.get()
+            if item is None:
+                return
+            try:
+                self._insert_rows(*item)
+            except Exception as e:
+                self.insert_error = e
+                # Keep draining the queue, so that the producer never blocks
+                while self.insert_queue.get() is not None:
+                    pass
+                return
+
+    def start_background_inserts(self, queue_size = 2):
+        '''
+        Runs the inserts of insert_fact_rows and insert_dim_rows in a background thread, overlapping the
+        database round trips with the partition assignment of the next batches. The connection must not be
+        used otherwise until wait_for_inserts is called. At most queue_size batches wait for insertion.
+        '''
+        import queue
+        import threading
+        self.insert_queue = queue.Queue(maxsize=queue_size)
+        self.insert_error = None
+        # The inserts count into the span of the caller
+        self.insert_thread = threading.Thread(target=tracer.wrap(self._insert_worker), daemon=True)
+        self.insert_thread.start()
+
+    def wait_for_inserts(self):
+        if self.insert_thread is None:
+            return
+        self.insert_queue.put(None)
+        self.insert_thread.join()
+        self.insert_thread = None
+        if self.insert_error is not None:
+            raise self.insert_error
+
+    def _submit_insert(self, tablename, rows):
+        if not rows:
+            return
+        if self.insert_thread is None:
+            self._insert_rows(tablename, rows)
+        elif self.insert_error is not None:
+            self.wait_for_inserts()
+        else:
+            self.insert_queue.put((tablename, rows))
 
-    def _pk_fk_column_offsets_by_pk_table(self, tablename):
-        dim_t_off = self._get_table_off_by_name(tablename)
-        if dim_t_off == self.UNKNOWN_OFFSET:
+    def insert_fact_rows(self, tablename, rows):
+        t_off = self._get_table_off_by_name(tablename) 
+        if t_off == self.UNKNOWN_OFFSET:
             print(f"Table {tablename} does not exist")
-            return (self.UNKNOWN_OFFSET, self.UNKNOWN_OFFSET)
-
-        fk_off = self._get_fk_off_by_pk_table(tablename)
-        if fk_off == self.UNKNOWN_OFFSET:
-            return (self.UNKNOWN_OFFSET, self.UNKNOWN_OFFSET)
-         
-        fk = self.fks[fk_off]
-
-        pk_off = self._get_col_off_by_name(dim_t_off, fk.pk_col)
-        fact_t_off = self._get_table_off_by_name(fk.fk_table)
-        fk_off = self._get_col_off_by_name(fact_t_off, fk.fk_col)
+            return
 
-        return (pk_off, fk_off)
+        if self.num_keys > 0 and rows:
+            parts = self.get_fact_partitions(*self.encode_key_columns(rows)).tolist()
+        else:
+            parts = [self._get_fact_partition(r) for r in rows]
+        for r, part in zip(rows, parts):
+            r.append(part)
+        self._submit_insert(tablename, rows)
 
     def insert_dim_rows(self, tablename, rows):
         dim_t_off = self._get_table_off_by_name(tablename)
@@ -305,100 +612,266 @@ class IterativePartitioner:
             print(f"Table {tablename} does not exist")
             return
         
-        pk_off, fk_off = self._pk_fk_column_offsets_by_pk_table(tablename)
-        if (pk_off == self.UNKNOWN_OFFSET or fk_off == self.UNKNOWN_OFFSET):
+        routes = self.dim_routes.get(tablename)
+        if routes is None:
             return
 
-        inserts = []
-        for r in rows:
-            for i in self.tables[dim_t_off].string_col_offs:
-                r[i] = f"'{r[i]}'"
-            r.append(self._get_dim_partition(r, fk_off, pk_off))
-            inserts.append(f"({','.join(str(x) for x in r)})")
+        for r, part in zip(rows, self._get_dim_partitions(routes, rows)):
+            r.append(part)
+        self._submit_insert(tablename, rows)
+
+    def _next_batch_size(self, batch_size):
+        '''
+        Adapts the batch size to the throughput of the last insert, aiming at TARGET_INSERT_LATENCY per insert.
+        '''
+        if self.insert_stats is None:
+            return batch_size
+        rows, latency = self.insert_stats
+        target = int(rows / max(latency, 1e-6) * self.TARGET_INSERT_LATENCY)
+        # Smooth the adaption, the latency of a single insert is noisy
+        target = (batch_size + target) // 2
+        return max(self.MIN_INSERT_BATCH, min(self.MAX_INSERT_BATCH, target))
+
+    @traced("load_table_from_file")
+    def load_table_from_file(self, tablename, filename, is_fact_table, limit = 0, background_inserts = True):
+        import os
         import time
+        from csv import reader
+        tracer.count("bytes_read", os.path.getsize(filename))
         start = time.perf_counter()
-        self._run_update_query(f"Insert into {tablename} values {','.join(inserts)}")
+        if background_inserts:
+            self.start_background_inserts()
+        try:
+            with open(filename, 'r') as read_obj:
+                csv_reader = reader(read_obj, delimiter='|')
+                total = 0
+                batch_size = self.MIN_INSERT_BATCH
+                batch = []
+                count = 0
+
+                for row in csv_reader:
+                    batch.append(row)
+                    count += 1
+
+                    if count >= batch_size:
+                        if is_fact_table:
+                            self.insert_fact_rows(tablename, batch)
+                        else:
+                            self.insert_dim_rows(tablename, batch)
+                        batch = []
+                        total += count
+                        count = 0
+                        batch_size = self._next_batch_size(batch_size)
+                        print(f"Finished {total} Tuples of {filename}",  end = "\r")
+
+                    if (limit > 0 and total >= limit): break
+
+            if batch:
+                if is_fact_table:
+                    self.insert_fact_rows(tablename, batch)
+                else:
+                    self.insert_dim_rows(tablename, batch)
+                total += len(batch)
+                print(f"Finished {total} Tuples of {filename}",  end = "\r")
+        finally:
+            # Also stops the insert thread if reading or partitioning a batch fails
+            self.wait_for_inserts()
         end = time.perf_counter()
-        self.time += end - start
+        print("")
+        print(f"Loaded {filename} in {end - start:0.4f} seconds")
 
-    def load_table_from_file(self, tablename, filename, is_fact_table, limit = 0):
+    def _write_partitioned_rows(self, write_obj, tablename, rows, is_fact_table):
+        if is_fact_table and self.num_keys > 0:
+            parts = self.get_fact_partitions(*self.encode_key_columns(rows)).tolist()
+        elif is_fact_table:
+            parts = [self._get_fact_partition(row) for row in rows]
+        else:
+            parts = self._get_dim_partitions(self.dim_routes[tablename], rows)
+
+        if isinstance(write_obj, PartitionFileWriter):
+            part_offs = {part: off for off, part in enumerate(self.part_id_map)}
+            shards = [[] for _ in range(self.num_partitions)]
+            for row, part in zip(rows, parts):
+                shards[part_offs[part]].append(('|'.join(row + [str(part)])) + "\n")
+            for part_off, lines in enumerate(shards):
+                if lines:
+                    write_obj.write(part_off, "".join(lines))
+        else:
+            write_obj.write("".join(('|'.join(row + [str(part)])) + "\n" for row, part in zip(rows, parts)))
+
+    @traced("partitioned_file_from_file")
+    def partitioned_file_from_file(self, tablename, filename, is_fact_table, batch_size = 16384, num_workers = 1, sharded = False):
+        '''
+        Writes a copy of filename with the partition identifier appended to each tuple.
+        With num_workers > 1, fact tables are parsed and written by a pool of worker processes
+        (see partitioning_pipeline), while the assignment stays sequential in this process.
+        With sharded, fact tuples are written into one file per partition instead (see
+        partition_writer.shard_filenames), which can be bulk loaded into the partitions in parallel.
+        Returns the name of the written file, or the list of partition files if sharded.
+        '''
+        import os
         import time
         from csv import reader
+        parts = filename.split(".")
+        extension = parts[-1]
+        part_filename = ".".join(parts[:-1]) + "_partitioned" + "." + extension
+
+        if sharded and not is_fact_table:
+            print("Sharded output is only supported for fact tables")
+            return None
+        if not is_fact_table and tablename not in self.dim_routes:
+            print(f"No foreign key references table {tablename}")
+            return None
+        filenames = shard_filenames(part_filename, self.num_partitions) if sharded else [part_filename]
+        out_str = f"{len(filenames)} partition files of {part_filename}" if sharded else part_filename
+
         start = time.perf_counter()
+        tracer.count("bytes_read", os.path.getsize(filename))
+        if num_workers > 1 and is_fact_table and self.num_keys > 0:
+            import partitioning_pipeline
+            tracer.count("rows", partitioning_pipeline.partitioned_file_from_file(self, tablename, filename, filenames, num_workers, sharded))
+            tracer.count("bytes", sum(os.path.getsize(f) for f in filenames))
+            end = time.perf_counter()
+            print(f"Wrote {out_str} in {end - start:0.4f} seconds")
+            return filenames if sharded else part_filename
+
+        write_obj = PartitionFileWriter(filenames) if sharded else open(part_filename, 'w')
         with open(filename, 'r') as read_obj:
             csv_reader = reader(read_obj, delimiter='|')
             total = 0
-            batch_size = 1000
             batch = []
-            count = 0
 
+            # Fact tuples are assigned batch-wise, see get_fact_partitions
             for row in csv_reader:
                 batch.append(row)
-                count += 1
 
-                if count >= batch_size:
-                    if is_fact_table:
-                        self.insert_fact_rows(tablename, batch)
-                    else:
-                        self.insert_dim_rows(tablename, batch)
+                if len(batch) >= batch_size:
+                    self._write_partitioned_rows(write_obj, tablename, batch, is_fact_table)
+                    total += len(batch)
                     batch = []
-                    count = 0
-                    total += batch_size
-                    print(f"Finished {total} Tuples of {filename}",  end = "\r")
-
-                if (limit > 0 and total >= limit): break
         
         if batch:
-            if is_fact_table:
-                self.insert_fact_rows(tablename, batch)
-            else:
-                self.insert_dim_rows(tablename, batch)
+            self._write_partitioned_rows(write_obj, tablename, batch, is_fact_table)
             total += len(batch)
-            print(f"Finished {total} Tuples of {filename}",  end = "\r")
+        write_obj.close()
+        tracer.count("rows", total)
+        tracer.count("bytes", sum(os.path.getsize(f) for f in filenames))
         end = time.perf_counter()
-        print("")
-        print(f"Loaded {filename} in {end - start:0.4f} seconds")
+        print(f"Wrote {out_str} in {end - start:0.4f} seconds")
+        return filenames if sharded else part_filename
+
+    def warm_start_from_table(self, tablename, part_col = "p", null_value = "", fetch_size = 100000):
+        '''
+        Bootstraps the mappings and partition counts from an already partitioned fact table with a single
+        grouped scan, so that new tuples (e.g. a daily delta via insert_fact_rows) are assigned consistently
+        with the existing ones. Key values occurring in several partitions become exceptions.
+        Tuples whose part_col is not a partition identifier of the mapping (e.g. exceptions and tuples without
+        edges of the GraphPartitioner) count in their physical partition (tid/10000000000000000).
+        Key values are converted to strings as read from flat files, NULL becomes null_value.
+        Must be called after the partition keys were added.
+        '''
+        t_off = self._get_table_off_by_name(tablename)
+        if t_off == self.UNKNOWN_OFFSET:
+            print(f"Table {tablename} does not exist")
+            return
 
-    def partitioned_file_from_file(self, tablename, filename, is_fact_table):
         import time
-        from csv import reader
-        parts = filename.split(".")
-        extension = parts[-1]
-        part_filename = ".".join(parts[:-1]) + "_partitioned" + "." + extension
-        write_obj = open(part_filename, 'w')
-
         start = time.perf_counter()
-        with open(filename, 'r') as read_obj:
-            csv_reader = reader(read_obj, delimiter='|')
-            total = 0
-            batch_size = 1000
-            batch = ""
-            count = 0
-
-            for row in csv_reader:
-                if is_fact_table:
-                    part = self._get_fact_partition(row)
-                else:
-                    pk_off, fk_off = self._pk_fk_column_offsets_by_pk_table(tablename)
-                    part = self._get_dim_partition(row, fk_off, pk_off)
-
-                batch += ('|'.join(row + [str(part)])) + "\n"
-                count += 1
+        key_cols = [self.tables[t_off].colnames[idx] for idx in self.key_map]
+        col_list = ", ".join(key_cols + [part_col, "tid/10000000000000000"])
+        cursor = self.con.cursor()
+        cursor.execute(f"select {col_list}, count(*) from {tablename} group by {col_list}")
+
+        part_offs = {part: off for off, part in enumerate(self.part_id_map)}
+        total = 0
+        unknown = 0
+        while True:
+            rs = cursor.fetchmany(fetch_size)
+            if not rs:
+                break
+            for row in rs:
+                part_off = part_offs.get(row[self.num_keys])
+                count = row[self.num_keys + 2]
+                if part_off is None:
+                    part_off = row[self.num_keys + 1]
+                    if part_off is None or not 0 <= part_off < self.num_partitions:
+                        unknown += count
+                        continue
+                part = self.part_id_map[part_off]
+                self.partition_counts[part_off] += count
+                total += count
+                values = [null_value if row[cnt] is None else str(row[cnt]) for cnt in range(self.num_keys)]
+                lookups = [self.mappings[cnt].get(value) for cnt, value in enumerate(values)]
+                updates = [None] * self.num_keys
+                for cnt, mapped in enumerate(lookups):
+                    if mapped is None:
+                        updates[cnt] = part
+                    elif mapped != part and mapped != self.EXCEPTION_MARKER:
+                        updates[cnt] = self.EXCEPTION_MARKER
+                    if updates[cnt] is not None:
+                        self.mappings[cnt][values[cnt]] = updates[cnt]
+                if self.statistics is not None:
+                    self.statistics.add_tuple(self.mappings, part_off, lookups, updates, values, count)
+        cursor.close()
 
-                if count >= batch_size:
-                    write_obj.write(batch)
-                    batch = ""
-                    count = 0
-                    total += batch_size
-        
-        if batch != "":
-            write_obj.write(batch)
-            total += count
+        if unknown > 0:
+            print(f"Ignored {unknown} tuples in physical partitions beyond the {self.num_partitions} partitions")
         end = time.perf_counter()
-        print(f"Wrote {part_filename} in {end - start:0.4f} seconds")
-        return part_filename
+        print(f"Bootstrapped mappings from {total} tuples of {tablename} in {end - start:0.4f} seconds")
+
+    def save_snapshot(self, filename):
+        '''
+        Saves mappings, partition counts and the round robin state, to continue partitioning
+        later with load_snapshot. Mappings are written in chunks to bound the memory.
+        '''
+        import pickle
+        with open(filename, 'wb') as f:
+            pickle.dump({"num_partitions": self.num_partitions, "key_map": self.key_map,
+                "partition_counts": self.partition_counts, "last_choice": self.last_choice,
+                "statistics": self.statistics}, f)
+            for m in self.mappings:
+                chunk = []
+                # With statistics, the tuple counters of the mapped key values are saved as well
+                for item in (m.counted_items() if self.statistics is not None else m.items()):
+                    chunk.append(item)
+                    if len(chunk) == self.SNAPSHOT_CHUNK:
+                        pickle.dump(chunk, f)
+                        chunk = []
+                # A chunk shorter than SNAPSHOT_CHUNK ends the mapping
+                pickle.dump(chunk, f)
+
+    def load_snapshot(self, filename):
+        '''
+        Restores the state saved by save_snapshot. The partitioner must be configured with the
+        same number of partitions and partition keys. Only load snapshots from trusted sources (pickle).
+        '''
+        import pickle
+        with open(filename, 'rb') as f:
+            header = pickle.load(f)
+            if header["num_partitions"] != self.num_partitions or header["key_map"] != self.key_map:
+                print("Snapshot does not match the partitions and partition keys of the partitioner")
+                return False
+
+            self.partition_counts = header["partition_counts"]
+            self.last_choice = header["last_choice"]
+            if self.statistics is not None and header["statistics"] is not None:
+                self.statistics = header["statistics"]
+            for cnt in range(self.num_keys):
+                m = self._new_mapping()
+                while True:
+                    chunk = pickle.load(f)
+                    for item in chunk:
+                        m[item[0]] = item[1]
+                        if len(item) == 3 and item[2] > 0 and self.statistics is not None:
+                            m.add_count(item[0], item[2])
+                    if len(chunk) < self.SNAPSHOT_CHUNK:
+                        break
+                self.mappings[cnt] = m
+        return True
 
     def finish_loading(self):
+        # Background inserts must be done before the tables are combined
+        self.wait_for_inserts()
         print(f"Insert queries took {self.time} seconds accumulated")
         for t in self.tables:
            self._run_update_query(f"Modify {t.name} to combine")
@@ -406,25 +879,79 @@ class IterativePartitioner:
             self._create_fk(i)
 
     def verify_partitioning(self):
+        '''
+        Checks that all tuples of a mapped key value are in the partition of its mapping.
+        Builds an index key value -> bitset of the partitions containing it in one pass over the traced
+        partitions, so the check is linear in the number of tuples.
+        Returns a list of (mapping number, key value, partition offsets) of the offending key values.
+        '''
         if not self.trace_partitions:
             print("Tracing was not enabled, cannot verify")
             return
-        
-        errors = 0
+
         print("Verifying")
+        part_offsets = {p: i for i, p in enumerate(self.part_id_map)}
+        offending = []
         for map_cnt, map in enumerate(self.mappings):
-            for key, part in map.items():
-                for part_cnt, p in enumerate(self.partitions[map_cnt]):
-                    if part != self.EXCEPTION_MARKER and part_cnt != part:
-                        if key in p:
-                            print(f"Found key {key} in partition {part_cnt} although it should be in {part} (Mapping {map_cnt})")
-                            errors += 1
-        if errors == 0:
+            occurrences = {}
+            for part_off, values in enumerate(self.partitions[map_cnt]):
+                bit = 1 << part_off
+                for key in set(values):
+                    occurrences[key] = occurrences.get(key, 0) | bit
+
+            for key, parts in occurrences.items():
+                part = map.get(key)
+                if part == self.EXCEPTION_MARKER:
+                    continue
+                expected = 0 if part is None else 1 << part_offsets[part]
+                if parts & ~expected:
+                    part_offs = [off for off in range(self.num_partitions) if parts >> off & 1]
+                    print(f"Found key {key} in partitions {part_offs} although it should be in {part} (Mapping {map_cnt})")
+                    offending.append((map_cnt, key, part_offs))
+        if not offending:
             print("Verified")
         else:
-            print("fNot verified, {errors} Errors")
-    
+            print(f"Not verified, {len(offending)} Errors")
+        return offending
+
+    def partition_statistics(self, null_value = ""):
+        '''
+        PartitionStatistics of the tuples assigned so far, from the in-memory state (needs collect_statistics
+        or trace_partitions), so that bad partitionings can be rejected before loading them.
+        A key value is an exception if its mapping is, i.e. its tuples are in several partitions.
+        Key values equal to null_value are not counted as distinct values.
+        '''
+        from partition_statistics import PartitionStatistics
+        fact_tables = [t for t in self.tables if t.is_fact_table]
+        if not fact_tables:
+            print("No fact table defined")
+            return None
+        columns = [fact_tables[0].colnames[idx] for idx in self.key_map]
+        if self.statistics is not None:
+            exceptions = [self.statistics.exception_tuples(key_idx) for key_idx in range(self.num_keys)]
+        elif self.trace_partitions:
+            exceptions = [sum(1 for values in partitioning for value in values if self.mappings[key_idx][value] == self.EXCEPTION_MARKER)
+                for key_idx, partitioning in enumerate(self.partitions)]
+        else:
+            print("Neither statistics nor tracing were enabled, cannot gather statistics")
+            return None
+
+        physical_sizes = {off: count for off, count in enumerate(self.partition_counts) if count > 0}
+        part_sizes = {self.part_id_map[off]: count for off, count in physical_sizes.items()}
+        if self.statistics is not None:
+            distinct_values = [self.statistics.distinct_values(key_idx) for key_idx in range(self.num_keys)]
+        else:
+            distinct_values = [len(m) for m in self.mappings]
+        distinct_values = {c: n - (null_value in m) for c, n, m in zip(columns, distinct_values, self.mappings)}
+        return PartitionStatistics(fact_tables[0].name, columns, sum(self.partition_counts),
+            physical_sizes, part_sizes, distinct_values, dict(zip(columns, exceptions)))
+
     def print_statistics(self):
+        if self.statistics is not None:
+            for line in self.statistics.report_lines(self.key_map):
+                print(line)
+            return
+
         if not self.trace_partitions:
             print("Tracing was not enabled, cannot gather statistics")
             return
@@ -0,0 +1,282 @@
+'''
+Reproducible benchmark of the partitioners on synthetic multi-key tables, without Actian Vector:
+The IterativePartitioner and both GraphPartitioner modes run end to end against the SQLite stand-in
+(see sqlite_standin), each case in a separate process so that the peak memory is per case. Besides the
+default stages, the GraphPartitioner runs with client-side graph construction (_client), overlapped
+stages (_streaming) and edge export over several connections (_parallel).
+Results are appended as JSON lines (runtime, throughput, peak RSS, balance factor, exception rates
+and the spans of timing.tracer), a baseline file of earlier results shows regressions.
+
+    python benchmark.py --rows 50000 --skew 0.5,1.2 --correlation 0.8 --baseline benchmark_results.jsonl
+'''
+import json
+import os
+import sys
+import numpy as np
+
+PARTITIONERS = ("iterative", "graph_t_as_e", "graph_t_as_v", "graph_t_as_e_client", "graph_t_as_e_streaming",
+    "graph_t_as_v_streaming", "graph_t_as_e_parallel", "graph_t_as_v_parallel")
+
+class Workload:
+    '''
+    Synthetic fact table with an id and one key column per cardinality. Key values are Zipf distributed with
+    exponent skew (0 is uniform). With probability correlation, the value of a key column is a fixed random
+    function of the value of the first key column instead of an independent draw.
+    '''
+    def __init__(self, rows = 20000, cardinalities = (1000, 200, 50), skew = 1.0, correlation = 0.5, seed = 0):
+        assert len(cardinalities) >= 2, "Tuples as edges needs at least 2 key columns"
+        assert 0 <= correlation <= 1
+        self.rows = rows
+        self.cardinalities = tuple(cardinalities)
+        self.skew = skew
+        self.correlation = correlation
+        self.seed = seed
+        self.keys = [f"k{i}" for i in range(len(cardinalities))]
+
+    @property
+    def name(self):
+        return f"r{self.rows}_c{'-'.join(map(str, self.cardinalities))}_s{self.skew}_corr{self.correlation}_seed{self.seed}"
+
+    def to_dict(self):
+        return {"rows": self.rows, "cardinalities": list(self.cardinalities), "skew": self.skew,
+            "correlation": self.correlation, "seed": self.seed}
+
+    def _zipf_codes(self, rng, cardinality, size):
+        weights = 1.0 / np.arange(1, cardinality + 1) ** self.skew
+        codes = rng.choice(cardinality, size=size, p=weights / weights.sum())
+        # Hot values are spread over the value domain
+        return rng.permutation(cardinality)[codes]
+
+    def generate(self):
+        '''
+        Returns the key columns as arrays of value codes.
+        '''
+        rng = np.random.default_rng(self.seed)
+        first = self._zipf_codes(rng, self.cardinalities[0], self.rows)
+        columns = [first]
+        for cardinality in self.cardinalities[1:]:
+            independent = self._zipf_codes(rng, cardinality, self.rows)
+            derived = rng.integers(0, cardinality, self.cardinalities[0])[first]
+            columns.append(np.where(rng.random(self.rows) < self.correlation, derived, independent))
+        return columns
+
+    def write_flat_file(self, filename):
+        '''
+        Writes the table as '|' separated flat file (id|k0|k1|...), as the IterativePartitioner reads it.
+        '''
+        columns = [c.tolist() for c in self.generate()]
+        with open(filename, "w") as f:
+            for start in range(0, self.rows, 100000):
+                f.write("".join("|".join([str(i)] + [f"v{c[i]}" for c in columns]) + "\n"
+                    for i in range(start, min(start + 100000, self.rows))))
+
+def _create_table(con, tablename, workload, part_col = None):
+    con.execute(f"Drop table if exists {tablename}")
+    key_cols = "".join(f", {k} VARCHAR(16)" for k in workload.keys)
+    part_str = f", {part_col} INT" if part_col else ""
+    con.execute(f"Create table {tablename}(tid BIGINT, id INT{key_cols}{part_str})")
+
+def _load_table(con, tablename, flat_file):
+    from csv import reader
+    with open(flat_file) as f:
+        rows = list(reader(f, delimiter='|'))
+    con.executemany(f"insert into {tablename} values ({', '.join('?' * len(rows[0]))})", rows)
+    con.commit()
+
+def _run_parallel_export(g, connect, num_connections, num_workers):
+    '''
+    The stages of GraphPartitioner.run, with the edges exported by table_to_edges_parallel.
+    '''
+    from timing import tracer
+    with tracer.span("table_to_graph"):
+        edges = g.table_to_edges_parallel(connect, num_connections)
+    with tracer.span("run_partitioning"):
+        part_edges = g.run_partitioning_in_process(edges, num_workers)
+    with tracer.span("graph_to_table"):
+        if not g.graph_to_table(part_edges):
+            return False
+    with tracer.span("apply_partitioning"):
+        return g.apply_partitioning()
+
+def run_case(workload, partitioner, num_partitions, flat_file, work_dir, num_workers = 1, sparsify = "star", num_connections = 2):
+    '''
+    Partitions the workload with partitioner on a fresh stand-in database and returns the result record.
+    num_connections: Connections of the _parallel edge export.
+    '''
+    from timing import tracer, max_rss
+    from sqlite_standin import StandinConnection
+    from partition_statistics import collect_statistics
+
+    database = os.path.join(work_dir, f"{workload.name}_{partitioner}.db")
+    if os.path.exists(database):
+        os.remove(database)
+    con = StandinConnection(database, num_partitions, workload.seed)
+    tablename = "bench"
+    tracer.reset()
+
+    if partitioner == "iterative":
+        from IterativePartitioner import IterativePartitioner
+        _create_table(con, tablename, workload, "p")
+        with tracer.span(partitioner) as span:
+            p = IterativePartitioner(con, num_partitions)
+            p.new_fact_table(tablename, ["id"] + workload.keys, ["int"] + ["varchar(16)"] * len(workload.keys),
+                None, list(range(1, len(workload.keys) + 1)))
+            for k in workload.keys:
+                p.add_partition_key(tablename, k)
+            p.load_table_from_file(tablename, flat_file, True)
+            # The table is hash partitioned on the partition identifier, as in example.py
+            con.execute(f"Modify {tablename} to reconstruct with partition=(hash on p {num_partitions} partitions)")
+            con.commit()
+        part_col = "p"
+    else:
+        from GraphPartitioner import GraphPartitioner
+        from edge_loader import SQLiteLoader
+        _create_table(con, tablename, workload)
+        _load_table(con, tablename, flat_file)
+        mode = 0 if partitioner.startswith("graph_t_as_e") else 1
+        variant = partitioner.split("_")[-1]
+        g = GraphPartitioner(con, tablename, workload.keys, num_partitions, False, True, False, mode, 0,
+            sparsify if mode == 1 else None, SQLiteLoader())
+        g.reset_partitioning()
+        with tracer.span(partitioner) as span:
+            if variant == "parallel":
+                ok = _run_parallel_export(g, lambda: StandinConnection(database, num_partitions, workload.seed),
+                    num_connections, num_workers)
+            else:
+                ok = g.run(None, num_workers=num_workers, client_side=variant == "client", streaming=variant == "streaming")
+        if not ok:
+            raise RuntimeError(f"{partitioner} failed")
+        part_col = "graph_partition"
+
+    stats = collect_statistics(con, tablename, workload.keys, part_col)
+    con.close()
+    os.remove(database)
+    return {"workload": workload.name, "parameters": workload.to_dict(), "partitioner": partitioner,
+        "num_partitions": num_partitions, "num_workers": num_workers,
+        "runtime_seconds": span.seconds, "rows_per_second": workload.rows / span.seconds,
+        "peak_rss_bytes": max_rss(), "balance_factor": stats.balance_factor(),
+        "exception_rates": stats.exception_rates, "spans": [s.to_dict() for s in tracer.roots]}
+
+def _case_process(conn, args):
+    try:
+        conn.send(run_case(*args))
+    except Exception as e:
+        conn.send({"error": repr(e)})
+    conn.close()
+
+def run_isolated(*args):
+    '''
+    run_case in a separate process, returns its result record or None if it failed.
+    '''
+    from multiprocessing import Pipe, Process
+    conn, child_conn = Pipe()
+    p = Process(target=_case_process, args=(child_conn, args))
+    p.start()
+    result = conn.recv() if conn.poll(None) else None
+    p.join()
+    if result is None or "error" in result:
+        print(f"Benchmark case {args[1]} on {args[0].name} failed: {result['error'] if result else p.exitcode}", file=sys.stderr)
+        return None
+    return result
+
+def git_revision():
+    import subprocess
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def load_results(filename):
+    if not os.path.isfile(filename):
+        return []
+    with open(filename) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def compare(results, baseline, threshold = 0.2):
+    '''
+    Prints the change of every result against the latest baseline result of the same case.
+    Returns the number of regressions: runtime slower by more than threshold, or a higher balance factor
+    or exception rate by more than threshold (relative, absolute for exception rates).
+    '''
+    latest = {}
+    for r in baseline:
+        latest[(r["workload"], r["partitioner"], r["num_partitions"])] = r
+    regressions = 0
+    for r in results:
+        b = latest.get((r["workload"], r["partitioner"], r["num_partitions"]))
+        if b is None:
+            continue
+        runtime = r["runtime_seconds"] / b["runtime_seconds"] - 1
+        balance = r["balance_factor"] / b["balance_factor"] - 1
+        exceptions = max(r["exception_rates"][k] - b["exception_rates"].get(k, 0) for k in r["exception_rates"])
+        regressed = runtime > threshold or balance > threshold or exceptions > threshold
+        regressions += regressed
+        print(f"{'REGRESSION ' if regressed else ''}{r['partitioner']} on {r['workload']}: runtime {runtime * 100:+.1f}%, "\
+            f"balance factor {balance * 100:+.1f}%, exception rate {exceptions * 100:+.2f} points (vs. {b.get('revision')})")
+    return regressions
+
+def main(argv = None):
+    import argparse
+    import tempfile
+    import time
+    parser = argparse.ArgumentParser(description="Benchmark the partitioners on synthetic multi-key tables")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--cardinalities", default="1000,200,50", help="Distinct values per key column")
+    parser.add_argument("--skew", default="1.0", help="Zipf exponents, comma separated")
+    parser.add_argument("--correlation", default="0.5", help="Key column correlations, comma separated")
+    parser.add_argument("--partitions", type=int, default=4)
+    parser.add_argument("--partitioners", default=",".join(PARTITIONERS))
+    parser.add_argument("--workers", type=int, default=1, help="Processes of the built-in edge partitioner")
+    parser.add_argument("--connections", type=int, default=2, help="Connections of the parallel edge export")
+    parser.add_argument("--sparsify", default="star", help="Value group edges of tuples as vertices (star, chain or clique)")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.jsonl", help="JSON lines file the results are appended to")
+    parser.add_argument("--baseline", help="JSON lines file of earlier results to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--work-dir", help="Directory of the flat files and stand-in databases")
+    args = parser.parse_args(argv)
+
+    partitioners = args.partitioners.split(",")
+    for p in partitioners:
+        if p not in PARTITIONERS:
+            print(f"Unknown partitioner {p}, choose from {', '.join(PARTITIONERS)}")
+            return 2
+    sparsify = None if args.sparsify == "clique" else args.sparsify
+    cardinalities = [int(c) for c in args.cardinalities.split(",")]
+    workloads = [Workload(args.rows, cardinalities, float(s), float(c), args.seed)
+        for s in args.skew.split(",") for c in args.correlation.split(",")]
+    baseline = load_results(args.baseline) if args.baseline else []
+    revision = git_revision()
+
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.work_dir) as work_dir:
+        for workload in workloads:
+            flat_file = os.path.join(work_dir, f"{workload.name}.tbl")
+            workload.write_flat_file(flat_file)
+            for partitioner in partitioners:
+                for _ in range(args.repeat):
+                    result = run_isolated(workload, partitioner, args.partitions, flat_file, work_dir, args.workers, sparsify,
+                        args.connections)
+                    if result is None:
+                        continue
+                    result["revision"] = revision
+                    result["timestamp"] = time.time()
+                    results.append(result)
+                    rates = ", ".join(f"{r * 100:.2f}%" for r in result["exception_rates"].values())
+                    rss = f", peak RSS {result['peak_rss_bytes'] / 2**20:.0f} MiB" if result["peak_rss_bytes"] else ""
+                    print(f"{partitioner} on {workload.name}: {result['runtime_seconds']:.03f} seconds, "\
+                        f"{result['rows_per_second']:.0f} rows/s{rss}, "\
+                        f"balance factor {result['balance_factor']:.3f}, exception rates {rates}")
+
+    with open(args.output, "a") as f:
+        for r in results:
+            f.write(json.dumps(r) + "\n")
+    print(f"Appended {len(results)} results to {args.output}")
+    if baseline and compare(results, baseline, args.threshold) > 0:
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
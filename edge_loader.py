@@ -0,0 +1,178 @@
+'''
+Loaders for the partitioned edges (t0, t1, part) into the graph_part table of the GraphPartitioner.
+
+The partitioned edges are either the in-memory result of the built-in partitioner, a binary
+partitioned edge file (int64 triples, see write_binary_part_edges) or the text .pedges file of
+DistributedNE. All loaders report their throughput the same way.
+'''
+import os
+import sys
+import numpy as np
+
+from odbc_utils import execute
+
+def write_binary_part_edges(filename, t0, t1, parts):
+    np.stack([t0, t1, parts], axis=1).astype(np.int64).tofile(filename)
+
+def read_part_edges(part_edges):
+    '''
+    Returns the partitioned edges as arrays (t0, t1, parts). Binary files are recognized by the .bin extension,
+    other files are read as text .pedges files with header.
+    '''
+    if not isinstance(part_edges, str):
+        return part_edges
+    if part_edges.endswith(".bin"):
+        edges = np.memmap(part_edges, dtype=np.int64, mode='r').reshape(-1, 3)
+    else:
+        edges = np.loadtxt(part_edges, dtype=np.int64, skiprows=1, ndmin=2).reshape(-1, 3)
+    return (edges[:, 0], edges[:, 1], edges[:, 2])
+
+def bulk_insert(connection, tablename, columns, batch_size = 100000, fast_executemany = True):
+    '''
+    Inserts the rows given as equally long arrays per column, batch-wise with parameterized executemany.
+    '''
+    cursor = connection.cursor()
+    if fast_executemany and hasattr(cursor, "fast_executemany"):
+        cursor.fast_executemany = True
+    from timing import tracer
+    q = f"insert into {tablename} values ({', '.join('?' * len(columns))})"
+    for start in range(0, len(columns[0]), batch_size):
+        rows = list(zip(*(c[start:start + batch_size].tolist() for c in columns)))
+        try:
+            cursor.executemany(q, rows)
+            tracer.count("queries")
+            tracer.count("rows", len(rows))
+        except Exception as e:
+            print(f"Failed to insert into {tablename}. Reason: {e}", file=sys.stderr)
+            cursor.close()
+            return False
+    cursor.close()
+    return True
+
+class EdgeLoader:
+    '''
+    Base class of the loaders: (re)creates graph_part, loads the edges with _load and reports the throughput.
+    '''
+    name = None
+
+    def load(self, connection, part_edges, verbose = False):
+        import time
+        from timing import tracer
+        if isinstance(part_edges, str) and not os.path.isfile(part_edges):
+            print("Could not find partitioned edgefile, please run partitioning first")
+            return False
+        if not self._check():
+            return False
+
+        start = time.perf_counter()
+        execute(connection, "Drop table if exists graph_part", verbose).close()
+        q = "Create table graph_part(t0 BIGINT, t1 BIGINT, part INT)"
+        execute(connection, q, verbose).close()
+        num_edges = self._load(connection, part_edges, verbose)
+        if num_edges is None:
+            return False
+        tracer.count("edges", num_edges)
+        t = time.perf_counter() - start
+        print(f"Loaded {num_edges} edges into graph_part with {self.name} in {t:.03f} seconds, {num_edges / max(t, 1e-9):.0f} edges/s")
+        return True
+
+    def _check(self):
+        return True
+
+    def _load(self, connection, part_edges, verbose):
+        '''
+        Loads the edges into graph_part, returns the number of edges or None on failure.
+        '''
+        raise NotImplementedError
+
+class VwloadLoader(EdgeLoader):
+    '''
+    Native bulk load with COPY ... VWLOAD. Text files are loaded as they are, other inputs are written to a
+    temporary text file in work_dir first (which must be accessible by the database server).
+    '''
+    name = "vwload"
+
+    def __init__(self, work_dir = None):
+        self.work_dir = work_dir
+
+    def _check(self):
+        from GraphPartitioner import find_in_path
+        if not find_in_path("vwload"):
+            print("Could not find vwload executable")
+            return False
+        return True
+
+    def _load(self, connection, part_edges, verbose):
+        import tempfile
+        if isinstance(part_edges, str) and not part_edges.endswith(".bin"):
+            filename = part_edges
+            with open(filename) as f:
+                num_edges = sum(1 for _ in f) - 1
+            remove = False
+        else:
+            t0, t1, parts = read_part_edges(part_edges)
+            fd, filename = tempfile.mkstemp(suffix=".pedges", dir=self.work_dir)
+            with os.fdopen(fd, "w") as f:
+                f.write("t0 t1 part\n")
+                for start in range(0, len(parts), 1000000):
+                    f.write("".join(f"{a} {b} {p}\n" for a, b, p in zip(t0[start:start + 1000000].tolist(),
+                        t1[start:start + 1000000].tolist(), parts[start:start + 1000000].tolist())))
+            num_edges = len(parts)
+            remove = True
+
+        path, file = os.path.split(os.path.abspath(filename))
+        load_q = f"COPY graph_part() VWLOAD FROM '{file}' "\
+            f"WITH FDELIM=' ',insertmode ='Bulk', header, WORK_DIR = '{path}'"
+        cur = execute(connection, load_q, verbose)
+        if remove:
+            os.remove(filename)
+        if cur is None:
+            return None
+        cur.close()
+        return num_edges
+
+class ExecutemanyLoader(EdgeLoader):
+    '''
+    Parameterized array inserts (with pyodbc's fast_executemany, if available), works with any DB-API connection.
+    '''
+    name = "executemany"
+
+    def __init__(self, batch_size = 100000):
+        self.batch_size = batch_size
+
+    def _load(self, connection, part_edges, verbose):
+        t0, t1, parts = read_part_edges(part_edges)
+        if not bulk_insert(connection, "graph_part", (t0, t1, parts), self.batch_size):
+            return None
+        return len(parts)
+
+class SQLiteLoader(EdgeLoader):
+    '''
+    Local stand-in for testing with sqlite3 or DuckDB connections: one executemany over a row generator
+    in a single transaction.
+    '''
+    name = "sqlite"
+
+    def _load(self, connection, part_edges, verbose):
+        t0, t1, parts = read_part_edges(part_edges)
+        try:
+            connection.executemany("insert into graph_part values (?, ?, ?)",
+                zip(t0.tolist(), t1.tolist(), parts.tolist()))
+            connection.commit()
+        except Exception as e:
+            print(f"Failed to insert into graph_part. Reason: {e}", file=sys.stderr)
+            return None
+        from timing import tracer
+        tracer.count("queries")
+        return len(parts)
+
+def default_loader(connection):
+    '''
+    SQLiteLoader for sqlite3 (including sqlite_standin) and DuckDB connections, otherwise VwloadLoader if vwload is installed, else ExecutemanyLoader.
+    '''
+    from GraphPartitioner import find_in_path
+    if type(connection).__module__.split(".")[0] in ("sqlite3", "sqlite_standin", "duckdb", "_duckdb"):
+        return SQLiteLoader()
+    if find_in_path("vwload"):
+        return VwloadLoader()
+    return ExecutemanyLoader()
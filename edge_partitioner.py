@@ -0,0 +1,252 @@
+'''
+Built-in edge partitioner based on neighbour expansion (NE, Zhang et al., KDD 2017) in the
+round-based variant of DistributedNE, replacing the external MPI binary.
+
+Every partition expands from a seed vertex: it repeatedly moves the boundary vertex with the
+fewest unassigned edges into its core and claims the unassigned edges of that vertex, plus the
+unassigned edges between newly reached vertices and the vertices it already reached. All
+partitions expand in rounds, each proposing the edges of up to EXPANSION_BATCH vertices; the
+proposals are resolved centrally (smaller partitions first), so every edge gets exactly one
+partition. With num_workers > 1, the partitions are distributed over worker processes that share
+the CSR adjacency and the edge owner array via shared memory.
+'''
+import numpy as np
+from multiprocessing import Pipe, Process
+from multiprocessing.shared_memory import SharedMemory
+
+UNASSIGNED = -1
+EXPANSION_BATCH = 8
+# Maximum partition size relative to a perfectly balanced partitioning
+DEFAULT_BALANCE = 1.1
+
+# Shared memory segments attached by a worker process
+_segments = []
+
+def build_csr(t0, t1):
+    '''
+    Builds the CSR adjacency of the undirected graph with the edges (t0[i], t1[i]).
+    Vertex identifiers are relabeled to 0..V-1. Returns a dict with the per edge endpoints
+    src, dst and the adjacency indptr, adj (neighbour) and adj_edges (edge number), both directions.
+    '''
+    num_edges = len(t0)
+    vertices, inverse = np.unique(np.concatenate([t0, t1]), return_inverse=True)
+    inverse = inverse.reshape(-1)
+    src = inverse[:num_edges]
+    dst = inverse[num_edges:]
+
+    ends = np.concatenate([src, dst])
+    order = np.argsort(ends, kind='stable')
+    indptr = np.zeros(len(vertices) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(ends, minlength=len(vertices)), out=indptr[1:])
+    edge_ids = np.arange(num_edges, dtype=np.int64)
+    return {"src": src, "dst": dst, "indptr": indptr,
+        "adj": np.concatenate([dst, src])[order], "adj_edges": np.concatenate([edge_ids, edge_ids])[order]}
+
+class _Expansion:
+    '''
+    Expansion state of one partition. Boundary vertices are kept in a heap with lazily updated
+    scores; scores only decrease while edges get assigned, so a popped score is an upper bound
+    and the selection is approximate, as in DistributedNE.
+    '''
+    def __init__(self, graph, part, batch, seed):
+        self.graph = graph
+        self.owner = graph["owner"]
+        self.part = part
+        self.batch = batch
+        self.rng = np.random.default_rng(seed + part)
+        num_vertices = len(graph["indptr"]) - 1
+        self.core = np.zeros(num_vertices, dtype=bool)
+        self.reached = np.zeros(num_vertices, dtype=bool)
+        self.heap = []
+        self.proposed = None
+        self.pending = []
+
+    def _edges(self, v):
+        start, end = self.graph["indptr"][v], self.graph["indptr"][v + 1]
+        return (self.graph["adj"][start:end], self.graph["adj_edges"][start:end])
+
+    def _score(self, v):
+        _, edges = self._edges(v)
+        return int(np.count_nonzero(self.owner[edges] == UNASSIGNED))
+
+    def _seed(self):
+        '''
+        Returns a random vertex with unassigned edges, None if all edges are assigned.
+        '''
+        num_edges = len(self.owner)
+        for _ in range(32):
+            e = int(self.rng.integers(num_edges))
+            if self.owner[e] == UNASSIGNED:
+                return int(self.graph["src"][e])
+        unassigned = np.flatnonzero(self.owner == UNASSIGNED)
+        if len(unassigned) == 0:
+            return None
+        return int(self.graph["src"][unassigned[self.rng.integers(len(unassigned))]])
+
+    def _next_vertex(self):
+        import heapq
+        while self.heap:
+            _, v = heapq.heappop(self.heap)
+            if self.core[v]:
+                continue
+            self.core[v] = True
+            if self._score(v) > 0:
+                return v
+        v = self._seed()
+        if v is not None:
+            self.core[v] = True
+            self.reached[v] = True
+        return v
+
+    def _accept(self):
+        '''
+        Adds the endpoints of the edges of the last proposal that were granted to this partition to
+        the boundary and queues the unassigned edges between them and the already reached vertices.
+        '''
+        import heapq
+        if self.proposed is None or len(self.proposed) == 0:
+            return
+        granted = self.proposed[self.owner[self.proposed] == self.part]
+        self.proposed = None
+        ends = np.unique(np.concatenate([self.graph["src"][granted], self.graph["dst"][granted]]))
+        new = ends[~self.reached[ends]]
+        self.reached[new] = True
+        for v in new.tolist():
+            neighbours, edges = self._edges(v)
+            closing = edges[(self.owner[edges] == UNASSIGNED) & self.reached[neighbours]]
+            if len(closing):
+                self.pending.append(closing)
+            heapq.heappush(self.heap, (self._score(v), v))
+
+    def propose(self, capacity):
+        '''
+        Returns the unassigned edges this partition claims in the current round, at most capacity.
+        '''
+        self._accept()
+        if capacity <= 0:
+            return np.empty(0, dtype=np.int64)
+        proposal = self.pending
+        self.pending = []
+        size = sum(len(e) for e in proposal)
+        for _ in range(self.batch):
+            if size >= capacity:
+                break
+            v = self._next_vertex()
+            if v is None:
+                break
+            _, edges = self._edges(v)
+            edges = edges[self.owner[edges] == UNASSIGNED]
+            proposal.append(edges)
+            size += len(edges)
+
+        if not proposal:
+            self.proposed = np.empty(0, dtype=np.int64)
+        else:
+            edges = np.unique(np.concatenate(proposal))
+            self.proposed = edges[self.owner[edges] == UNASSIGNED][:capacity]
+        return self.proposed
+
+def _share(graph):
+    segments = []
+    specs = {}
+    for name, a in graph.items():
+        shm = SharedMemory(create=True, size=max(1, a.nbytes))
+        np.ndarray(a.shape, dtype=a.dtype, buffer=shm.buf)[:] = a
+        segments.append(shm)
+        specs[name] = (shm.name, a.shape, a.dtype.str)
+    return (segments, specs)
+
+def _attach(specs):
+    graph = {}
+    for name, (shm_name, shape, dtype) in specs.items():
+        shm = SharedMemory(shm_name)
+        _segments.append(shm)
+        graph[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    return graph
+
+def _worker(conn, specs, parts, batch, seed):
+    graph = _attach(specs)
+    expansions = [_Expansion(graph, part, batch, seed) for part in parts]
+    while True:
+        capacities = conn.recv()
+        if capacities is None:
+            break
+        conn.send([e.propose(capacities[e.part]) for e in expansions])
+    conn.close()
+
+def partition_edges(t0, t1, num_partitions, num_workers = 1, balance = DEFAULT_BALANCE, batch = EXPANSION_BATCH, seed = 0, on_assigned = None):
+    '''
+    Partitions the edges (t0[i], t1[i]) into num_partitions partitions of at most balance * |E| / num_partitions edges.
+    Returns the partition (0..num_partitions-1) of every edge as int32 array.
+    Assignments are final, on_assigned(edge numbers, part) is called for the edges assigned in every round,
+    so that consumers can process them while the partitioning continues.
+    '''
+    graph = build_csr(np.asarray(t0), np.asarray(t1))
+    num_edges = len(graph["src"])
+    graph["owner"] = np.full(num_edges, UNASSIGNED, dtype=np.int32)
+    limit = max(1, int(np.ceil(balance * num_edges / num_partitions)))
+    sizes = [0] * num_partitions
+
+    segments = []
+    workers = []
+    try:
+        if num_workers > 1:
+            segments, specs = _share(graph)
+            owner = np.ndarray(num_edges, dtype=np.int32, buffer=segments[-1].buf)
+            for w in range(min(num_workers, num_partitions)):
+                conn, child_conn = Pipe()
+                p = Process(target=_worker, args=(child_conn, specs, list(range(w, num_partitions, num_workers)), batch, seed))
+                p.start()
+                workers.append((p, conn))
+        else:
+            owner = graph["owner"]
+            expansions = [_Expansion(graph, part, batch, seed) for part in range(num_partitions)]
+
+        unassigned = num_edges
+        while unassigned > 0:
+            capacities = [limit - s for s in sizes]
+            if workers:
+                for _, conn in workers:
+                    conn.send(capacities)
+                proposals = [None] * num_partitions
+                for w, (_, conn) in enumerate(workers):
+                    for part, edges in zip(range(w, num_partitions, num_workers), conn.recv()):
+                        proposals[part] = edges
+            else:
+                proposals = [e.propose(c) for e, c in zip(expansions, capacities)]
+
+            # Conflicting claims go to the smaller partition
+            progress = 0
+            for part in sorted(range(num_partitions), key=lambda k: sizes[k]):
+                edges = proposals[part]
+                edges = edges[owner[edges] == UNASSIGNED][:limit - sizes[part]]
+                owner[edges] = part
+                if on_assigned is not None and len(edges):
+                    on_assigned(edges, part)
+                sizes[part] += len(edges)
+                progress += len(edges)
+            if progress == 0:
+                break
+            unassigned -= progress
+
+        if unassigned > 0:
+            # Only reached if all partitions are full, e.g. for tiny graphs
+            rest = np.flatnonzero(owner == UNASSIGNED)
+            owner[rest] = sizes.index(min(sizes))
+            if on_assigned is not None:
+                on_assigned(rest, sizes.index(min(sizes)))
+        return owner.copy()
+    finally:
+        for p, conn in workers:
+            conn.send(None)
+            p.join()
+        for shm in segments:
+            shm.close()
+            shm.unlink()
+
+def replication_factor(t0, t1, parts):
+    '''
+    Average number of partitions a vertex has edges in, the quality measure of edge partitionings.
+    '''
+    vertex_parts = np.unique(np.stack([np.concatenate([t0, t1]), np.concatenate([parts, parts])]), axis=1)
+    return vertex_parts.shape[1] / len(np.unique(vertex_parts[0]))
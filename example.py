@@ -20,10 +20,20 @@ def run_graph_partitioner(connection, table, columns, num_partitions, mode):
     exectime = tok(start)
     return exectime - waittime
 
-def graph_part_exp(connection, tablename, part_keys, num_partitions, mode):
+def partition_quality(connection, tablename, part_keys, approximate = False):
+    '''
+    Balance factor and exception rates, estimated from a sample with approximate (to compare candidate
+    partitionings quickly), otherwise exact.
+    '''
+    if approximate:
+        stats = sample_statistics(connection, tablename, part_keys)
+    else:
+        stats = collect_statistics(connection, tablename, part_keys)
+    return (stats.balance_factor(), [stats.exception_rates[c] for c in part_keys])
+
+def graph_part_exp(connection, tablename, part_keys, num_partitions, mode, approximate = False):
     exectime = run_graph_partitioner(connection, tablename, part_keys, num_partitions, mode)
-    balance_factor = partition_balance_factor(connection, tablename)
-    exception_rates = num_exceptions(connection, tablename, part_keys)
+    balance_factor, exception_rates = partition_quality(connection, tablename, part_keys, approximate)
     mode_str = "t_as_e" if mode == 0 else "t_as_v"
     result = ["Graph_" + mode_str] + part_keys + [exectime, balance_factor] + exception_rates
     return result
@@ -39,7 +49,13 @@ def vwload(dbname, tablename, filepath):
     cmd = ["vwload", "--timing", "--cluster", "--table", tablename, "-n", "null", dbname, filepath] 
     subprocess.run(cmd)
 
-def run_iterative_partitioner(con, tablename, num_partitions, part_cols, input_file, output_file):
+def vwload_partitions(dbname, tablename, filepaths):
+    # vwload loads the given files in parallel, each file holds the tuples of one partition
+    import subprocess
+    cmd = ["vwload", "--timing", "--cluster", "--table", tablename, "-n", "null", dbname] + filepaths
+    subprocess.run(cmd)
+
+def run_iterative_partitioner(con, tablename, num_partitions, part_cols, input_file):
     from IterativePartitioner import IterativePartitioner
     import os
     p = IterativePartitioner(con, num_partitions, False)
@@ -127,23 +143,23 @@ def run_iterative_partitioner(con, tablename, num_partitions, part_cols, input_f
     p.new_fact_table(tablename, commongovernment_cols, commongovernment_col_types, None, part_col_offs)
     for c in part_cols:
         p.add_partition_key(tablename, c)
-    part_filename = p.partitioned_file_from_file(tablename, input_file, True)
+    part_filenames = p.partitioned_file_from_file(tablename, input_file, True, sharded = True)
     p.print_statistics()
-    os.rename(part_filename, output_file)
+    # Quality of the partitioning before paying for the load
+    file_statistics(part_filenames, part_col_offs, part_cols, p.part_id_map).print(num_partitions)
 
     run_update_query(drop_q.format(tablename = tablename), con)
     run_update_query(create_q_graph_part.format(tablename = tablename, num_partitions = num_partitions), con)
-    vwload(dbname, tablename, output_file)
-    os.remove(output_file)
+    vwload_partitions(dbname, tablename, part_filenames)
+    for f in part_filenames:
+        os.remove(f)
 
 
-def iterative_part_exp(connection, tablename, part_keys, num_partitions, flat_file):
-    partitioned_flat_file = "/tmp/part_flat_file.csv"
+def iterative_part_exp(connection, tablename, part_keys, num_partitions, flat_file, approximate = False):
     start = tik()
-    run_iterative_partitioner(connection, tablename, num_partitions, part_keys, flat_file, partitioned_flat_file)
+    run_iterative_partitioner(connection, tablename, num_partitions, part_keys, flat_file)
     exectime = tok(start)
-    balance_factor = partition_balance_factor(connection, tablename)
-    exception_rates = num_exceptions(connection, tablename, part_keys)
+    balance_factor, exception_rates = partition_quality(connection, tablename, part_keys, approximate)
     result = ["Iterative"] + part_keys + [exectime, balance_factor] + exception_rates
     return result
 
@@ -211,4 +227,9 @@ if __name__ == "__main__":
     
     df = pd.DataFrame(three_col_results, columns = ['Partitioner', 'Col1', 'Col2', 'Col3', 'Runtime', 'Partition_balance_factor', 'Exceptions1', 'Exceptions2', 'Exceptions3'])
     print(df)
-    df.to_csv("/tmp/three_cols.csv")
\ No newline at end of file
+    df.to_csv("/tmp/three_cols.csv")
+    # Where the time of the runs went, per stage
+    for line in tracer.report_lines():
+        print(line)
+    tracer.to_json("/tmp/partitioning_trace.json")
+    tracer.write_prometheus("/tmp/partitioning.prom")
@@ -0,0 +1,66 @@
+'''
+HyperLogLog sketch (Flajolet et al., 2007) for distinct value estimates in a single pass with fixed memory.
+'''
+import hashlib
+import numpy as np
+
+def hash64(values):
+    '''
+    64 bit hashes of the values as uint64 array. Integers are mixed with splitmix64, other values
+    are hashed by their string representation, so equal values hash equally across processes.
+    '''
+    if all(type(v) is int for v in values):
+        h = np.asarray(values, dtype=np.int64).astype(np.uint64)
+        h += np.uint64(0x9E3779B97F4A7C15)
+        h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return h ^ (h >> np.uint64(31))
+    return np.fromiter((int.from_bytes(hashlib.blake2b(str(v).encode(), digest_size=8).digest(), "little")
+        for v in values), dtype=np.uint64, count=len(values))
+
+class HyperLogLog:
+    '''
+    2^precision registers, the relative standard error of estimate is about 1.04 / sqrt(2^precision).
+    '''
+    def __init__(self, precision = 12):
+        assert 4 <= precision <= 18
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, values):
+        '''
+        Adds the values (a sequence), None is ignored.
+        '''
+        values = [v for v in values if v is not None]
+        if values:
+            self.add_hashes(hash64(values))
+
+    def add_hashes(self, hashes):
+        p = self.precision
+        idx = (hashes >> np.uint64(64 - p)).astype(np.int64)
+        rest = hashes & np.uint64((1 << (64 - p)) - 1)
+        # Bit length via the float exponent, exact except for values with 53 leading ones (probability 2^-53)
+        bit_length = np.minimum(np.frexp(rest.astype(np.float64))[1], 64 - p)
+        np.maximum.at(self.registers, idx, (64 - p - bit_length + 1).astype(np.uint8))
+
+    def merge(self, other):
+        assert self.precision == other.precision
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        e = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int32)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if e <= 2.5 * m and zeros > 0:
+            # Linear counting for small cardinalities
+            e = m * np.log(m / zeros)
+        return float(e)
+
+    def interval(self, z = 1.96):
+        '''
+        Approximate confidence interval of the estimate, z standard errors wide on each side.
+        '''
+        e = self.estimate()
+        error = z * 1.04 / float(np.sqrt(len(self.registers)))
+        return (e * max(0.0, 1 - error), e * (1 + error))
@@ -0,0 +1,90 @@
+'''
+Partition identifier mappings for partition counts without entry in identifier_mapping_dict:
+The identifiers are found by probing the hash function of the database in batches and kept in a
+persistent on-disk cache (JSON), which both partitioners consult.
+'''
+import json
+import os
+import sys
+
+from identifier_mapping_dict import partition_identifier_mapping_dict
+from odbc_utils import execute
+
+CACHE_FILE = os.environ.get("PARTITION_IDENTIFIER_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "patched_partitioning", "identifier_mappings.json"))
+PROBE_BATCH = 4096
+# Identifiers must fit into the SMALLINT graph_partition column
+MAX_IDENTIFIER = 32767
+
+def load_cache(cache_file = CACHE_FILE):
+    if not os.path.isfile(cache_file):
+        return {}
+    with open(cache_file) as f:
+        return {int(n): mapping for n, mapping in json.load(f).items()}
+
+def store_mapping(num_partitions, mapping, cache_file = CACHE_FILE):
+    cache = load_cache(cache_file)
+    cache[num_partitions] = mapping
+    os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+    # Replace atomically, concurrent partitioners must not see partially written files
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump({str(n): m for n, m in sorted(cache.items())}, f)
+    os.replace(tmp_file, cache_file)
+
+def probe_identifier_mapping(connection, num_partitions, batch_size = PROBE_BATCH, verbose = False):
+    '''
+    Finds for every hash bucket 0..n-1 the smallest identifier > n that the database hashes into it,
+    evaluating batch_size candidates per query instead of one query per candidate.
+    Returns the mapping, or None if the identifiers up to MAX_IDENTIFIER do not cover all buckets.
+    '''
+    import numpy as np
+    from edge_loader import bulk_insert
+    q = "DECLARE GLOBAL TEMPORARY TABLE id_candidates (i INT) ON COMMIT PRESERVE ROWS WITH NORECOVERY"
+    cur = execute(connection, q, verbose)
+    if cur is None:
+        return None
+    cur.close()
+
+    mapping = [None] * num_partitions
+    filled = 0
+    try:
+        for start in range(num_partitions + 1, MAX_IDENTIFIER + 1, batch_size):
+            execute(connection, "Delete from id_candidates", verbose).close()
+            candidates = np.arange(start, min(start + batch_size, MAX_IDENTIFIER + 1))
+            if not bulk_insert(connection, "id_candidates", (candidates,)):
+                return None
+            cur = execute(connection, f"Select i, mod(hash(i), {num_partitions}) from id_candidates order by i", verbose)
+            for i, bucket in cur.fetchall():
+                if mapping[bucket] is None:
+                    mapping[bucket] = i
+                    filled += 1
+            cur.close()
+            if filled == num_partitions:
+                return mapping
+    finally:
+        execute(connection, "Drop table session.id_candidates", verbose, True).close()
+
+    print(f"Cannot find a partition identifier mapping for {num_partitions} partitions "\
+        f"with identifiers up to {MAX_IDENTIFIER}", file=sys.stderr)
+    return None
+
+def get_identifier_mapping(num_partitions, connection = None, cache_file = CACHE_FILE, verbose = False):
+    '''
+    Returns the partition identifier mapping for num_partitions from identifier_mapping_dict or the cache.
+    Otherwise it is probed on connection (if given) and added to the cache. None if not available.
+    '''
+    mapping = partition_identifier_mapping_dict.get(num_partitions)
+    if mapping is not None:
+        return mapping
+    mapping = load_cache(cache_file).get(num_partitions)
+    if mapping is not None:
+        if verbose: print(f"Using cached partition identifier mapping from {cache_file}.")
+        return mapping
+    if connection is None:
+        return None
+
+    mapping = probe_identifier_mapping(connection, num_partitions, verbose = verbose)
+    if mapping is not None:
+        store_mapping(num_partitions, mapping, cache_file)
+    return mapping
@@ -0,0 +1,304 @@
+import mmap
+import os
+import pickle
+import shutil
+import tempfile
+import weakref
+import zlib
+from array import array
+
+_MISSING = object()
+
+class CompactKeyMapping:
+    '''
+    Key value -> partition mapping with the interface of the dicts used by the IterativePartitioner
+    (get, [], in, len, items), but without one Python object per key value.
+    Key values are encoded to bytes and interned into one contiguous arena, an open addressing
+    hash index over the arena holds the entry numbers and each entry stores its partition as int16
+    partition offset (or the exception marker). A mapped key value costs its encoded length plus ~16 bytes,
+    plus 8 bytes once tuple counters are used (see add_count).
+    NOTE: Key values are compared by their encoding, i.e. 1 and "1" are different keys.
+    '''
+    EMPTY_SLOT = -1
+    EXCEPTION_OFFSET = -1
+    MAX_LOAD_FACTOR = 0.75
+    INDEX_TYPECODE = 'i'
+
+    # Type tags of the encoded key values
+    TAG_NONE = b"\x00"
+    TAG_STR = b"\x01"
+    TAG_OTHER = b"\x02"
+
+    def __init__(self, part_id_map, exception_marker = -1, capacity = 1024):
+        assert len(part_id_map) < 2**15, "Partition offsets must fit into int16"
+        self.part_id_map = part_id_map
+        self.part_offsets = {p: i for i, p in enumerate(part_id_map)}
+        self.exception_marker = exception_marker
+
+        self.arena = self._allocate('B')
+        # Entry i is arena[key_offsets[i]:key_offsets[i+1]]
+        self.key_offsets = self._allocate('Q', 1, 0)
+        self.parts = self._allocate('h')
+        # Tuple counters of the entries, allocated by the first add_count
+        self.counts = None
+
+        size = 1
+        while size < capacity: size *= 2
+        self.index = self._allocate(self.INDEX_TYPECODE, size, self.EMPTY_SLOT)
+        self.mask = size - 1
+
+    def _allocate(self, typecode, size = 0, fill = 0):
+        return array(typecode, [fill]) * size
+
+    def _encode(self, key):
+        if isinstance(key, str):
+            return self.TAG_STR + key.encode()
+        if key is None:
+            return self.TAG_NONE
+        return self.TAG_OTHER + pickle.dumps(key)
+
+    def _decode(self, key_bytes):
+        tag = key_bytes[:1]
+        if tag == self.TAG_STR:
+            return key_bytes[1:].decode()
+        if tag == self.TAG_NONE:
+            return None
+        return pickle.loads(key_bytes[1:])
+
+    def _key_bytes(self, entry):
+        return self.arena[self.key_offsets[entry]:self.key_offsets[entry + 1]].tobytes()
+
+    def _append_key(self, key_bytes):
+        self.arena.frombytes(key_bytes)
+        self.key_offsets.append(len(self.arena))
+
+    def _find(self, key_bytes):
+        '''
+        Returns the index slot of key_bytes and its entry number (EMPTY_SLOT if not contained).
+        '''
+        slot = zlib.crc32(key_bytes) & self.mask
+        while True:
+            entry = self.index[slot]
+            if entry == self.EMPTY_SLOT or self._key_bytes(entry) == key_bytes:
+                return (slot, entry)
+            slot = (slot + 1) & self.mask
+
+    def _grow(self):
+        # Hashes are not stored, but recomputed from the arena
+        size = (self.mask + 1) * 2
+        self.index = self._allocate(self.INDEX_TYPECODE, size, self.EMPTY_SLOT)
+        self.mask = size - 1
+        for entry in range(len(self.parts)):
+            slot = zlib.crc32(self._key_bytes(entry)) & self.mask
+            while self.index[slot] != self.EMPTY_SLOT:
+                slot = (slot + 1) & self.mask
+            self.index[slot] = entry
+
+    def _to_part(self, part_off):
+        return self.exception_marker if part_off == self.EXCEPTION_OFFSET else self.part_id_map[part_off]
+
+    def _to_part_off(self, part):
+        return self.EXCEPTION_OFFSET if part == self.exception_marker else self.part_offsets[part]
+
+    def get(self, key, default = None):
+        _, entry = self._find(self._encode(key))
+        if entry == self.EMPTY_SLOT:
+            return default
+        return self._to_part(self.parts[entry])
+
+    def __getitem__(self, key):
+        part = self.get(key, _MISSING)
+        if part is _MISSING:
+            raise KeyError(key)
+        return part
+
+    def __setitem__(self, key, part):
+        key_bytes = self._encode(key)
+        slot, entry = self._find(key_bytes)
+        if entry != self.EMPTY_SLOT:
+            self.parts[entry] = self._to_part_off(part)
+            return
+
+        entry = len(self.parts)
+        self._append_key(key_bytes)
+        self.parts.append(self._to_part_off(part))
+        if self.counts is not None:
+            self.counts.append(0)
+        self.index[slot] = entry
+        if len(self.parts) > self.MAX_LOAD_FACTOR * (self.mask + 1):
+            self._grow()
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self.parts)
+
+    def keys(self):
+        for entry in range(len(self.parts)):
+            yield self._decode(self._key_bytes(entry))
+
+    def items(self):
+        for entry, key in enumerate(self.keys()):
+            yield (key, self._to_part(self.parts[entry]))
+
+    def __iter__(self):
+        return self.keys()
+
+    def add_count(self, key, count):
+        '''
+        Adds count to the tuple counter kept next to the partition of key, which must be contained
+        (see streaming_statistics).
+        '''
+        _, entry = self._find(self._encode(key))
+        assert entry != self.EMPTY_SLOT, "Tuples can only be counted for contained key values"
+        if self.counts is None:
+            self.counts = self._allocate('q', len(self.parts), 0)
+        self.counts[entry] += count
+
+    def pop_count(self, key):
+        '''
+        Returns the tuple counter of key and resets it.
+        '''
+        if self.counts is None:
+            return 0
+        _, entry = self._find(self._encode(key))
+        if entry == self.EMPTY_SLOT:
+            return 0
+        count = self.counts[entry]
+        self.counts[entry] = 0
+        return count
+
+    def counted_items(self):
+        '''
+        Like items, with the tuple counter as third element.
+        '''
+        for entry, (key, part) in enumerate(self.items()):
+            yield (key, part, 0 if self.counts is None else self.counts[entry])
+
+    def _arrays(self):
+        return [a for a in (self.arena, self.key_offsets, self.parts, self.index, self.counts) if a is not None]
+
+    def memory_usage(self):
+        '''
+        Returns the number of bytes allocated for arena, entries, tuple counters and hash index.
+        '''
+        return sum(a.itemsize * len(a) for a in self._arrays())
+
+class MappedArray:
+    '''
+    Growable array of a fixed item type in a memory-mapped file, supporting the subset of
+    array.array used by the mapping stores. Only the pages in use occupy memory (page cache).
+    '''
+    def __init__(self, filename, typecode, size = 0, fill = 0):
+        self.typecode = typecode
+        self.itemsize = array(typecode).itemsize
+        self.file = open(filename, 'w+b')
+        self.length = 0
+        self.capacity = 0
+        self.mm = None
+        self.view = None
+        self._resize(max(size, 1024))
+        if size > 0:
+            self._fill(0, size, fill)
+            self.length = size
+
+    def _resize(self, capacity):
+        if self.view is not None:
+            self.view.release()
+            self.mm.close()
+        self.file.truncate(capacity * self.itemsize)
+        self.mm = mmap.mmap(self.file.fileno(), capacity * self.itemsize)
+        self.view = memoryview(self.mm).cast(self.typecode)
+        self.capacity = capacity
+
+    def _fill(self, start, end, fill):
+        pattern = array(self.typecode, [fill]).tobytes()
+        # Fill in steps, to not materialize huge patterns in memory
+        step = 1 << 20
+        for pos in range(start, end, step):
+            n = min(step, end - pos)
+            self.mm[pos * self.itemsize:(pos + n) * self.itemsize] = pattern * n
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.view[i.start:i.stop]
+        return self.view[i]
+
+    def __setitem__(self, i, value):
+        self.view[i] = value
+
+    def append(self, value):
+        if self.length == self.capacity:
+            self._resize(self.capacity * 2)
+        self.view[self.length] = value
+        self.length += 1
+
+    def frombytes(self, data):
+        count = len(data) // self.itemsize
+        if self.length + count > self.capacity:
+            self._resize(max(self.capacity * 2, self.length + count))
+        self.mm[self.length * self.itemsize:(self.length + count) * self.itemsize] = data
+        self.length += count
+
+    def close(self):
+        self.view.release()
+        self.mm.close()
+        self.file.close()
+
+class SpillableKeyMapping(CompactKeyMapping):
+    '''
+    CompactKeyMapping whose arena, entries and hash index live in memory-mapped files, so the number
+    of distinct key values is bounded by disk space instead of memory. The operating system keeps the
+    used pages in the page cache; additionally, the most recently used cache_size key values are kept
+    in an in-memory LRU cache. Updates are written through to the files, so evictions are free.
+    Use functools.partial to pass cache_size and directory via IterativePartitioner(mapping_store = ...).
+    '''
+    INDEX_TYPECODE = 'q'
+
+    def __init__(self, part_id_map, exception_marker = -1, cache_size = 1000000, directory = None, capacity = 1 << 16):
+        # Every mapping gets its own files in a new directory below directory (default: system temp directory)
+        self.directory = tempfile.mkdtemp(prefix="key_mapping_", dir=directory)
+        self.remove_files = weakref.finalize(self, shutil.rmtree, self.directory, ignore_errors=True)
+        self.num_files = 0
+        self.cache = {}
+        self.cache_size = cache_size
+        super().__init__(part_id_map, exception_marker, capacity)
+
+    def _allocate(self, typecode, size = 0, fill = 0):
+        self.num_files += 1
+        return MappedArray(os.path.join(self.directory, f"{self.num_files}.bin"), typecode, size, fill)
+
+    def _grow(self):
+        old_index = self.index
+        super()._grow()
+        old_index.close()
+        os.remove(old_index.file.name)
+
+    def get(self, key, default = None):
+        part = self.cache.pop(key, _MISSING)
+        if part is _MISSING:
+            part = super().get(key, _MISSING)
+            if part is _MISSING:
+                return default
+            if len(self.cache) >= self.cache_size:
+                # Dicts keep insertion order, so the first key is the least recently used
+                del self.cache[next(iter(self.cache))]
+        self.cache[key] = part
+        return part
+
+    def __setitem__(self, key, part):
+        super().__setitem__(key, part)
+        if key in self.cache:
+            self.cache[key] = part
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def close(self):
+        for a in self._arrays():
+            a.close()
+        self.remove_files()
@@ -7,6 +7,8 @@ def commit(connection):
         print(f"Failed to commit session. Reason: {e}", file=sys.stderr)
 
 def execute(connection, sql, verbose = False, mightFail = False):
+    from timing import tracer
+    tracer.count("queries")
     cursor = connection.cursor()
     if verbose: print(f"{sql};")
     try:
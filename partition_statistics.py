@@ -56,4 +56,422 @@ def num_exceptions(connection, tablename, columns):
         num_exceptions = row[0]
         exception_rates.append(num_exceptions/total_card)
 
-    return exception_rates
\ No newline at end of file
+    return exception_rates
+
+class PartitionStatistics:
+    '''
+    Partitioning statistics of a table, see collect_statistics.
+    physical_sizes: Tuples per physical partition (tid/10000000000000000)
+    part_sizes: Tuples per partition identifier (value of the partition column)
+    distinct_values, exceptions, exception_rates: Per key column; tuples are exceptions if their
+        key value occurs in several partitions or with a negative (exception) partition identifier.
+    '''
+    def __init__(self, tablename, columns, cardinality, physical_sizes, part_sizes, distinct_values, exceptions):
+        self.tablename = tablename
+        self.columns = columns
+        self.cardinality = cardinality
+        self.physical_sizes = physical_sizes
+        self.part_sizes = part_sizes
+        self.distinct_values = distinct_values
+        self.exceptions = exceptions
+        self.exception_rates = {c: exceptions[c] / cardinality if cardinality else 0.0 for c in columns}
+
+    def balance(self):
+        '''
+        Relative deviation of the smallest and largest physical partition from a balanced partitioning, as partition_balance.
+        '''
+        balanced = self.cardinality / len(self.physical_sizes)
+        sizes = self.physical_sizes.values()
+        return ((min(sizes) - balanced) / balanced, (max(sizes) - balanced) / balanced)
+
+    def balance_factor(self):
+        '''
+        Largest divided by smallest physical partition, as partition_balance_factor.
+        '''
+        sizes = self.physical_sizes.values()
+        return float(max(sizes)) / float(min(sizes))
+
+    def print(self, num_partitions = None, physical = True):
+        '''
+        Prints the statistics, partition sizes relative to a balanced partitioning into num_partitions
+        (default: the number of physical partitions). Physical partition sizes only with physical.
+        '''
+        print(f"\nTable: {self.tablename}\nColumns: {self.columns})")
+        print(f"Total tuples: {self.cardinality}")
+        for c in self.columns:
+            print(f"Distinct values of {c}: {self.distinct_values[c]}")
+        for c in self.columns:
+            print(f"Exception rate in column {c}: {self.exception_rates[c] * 100:6.3f}%")
+
+        equal_part_size = self.cardinality / (num_partitions or len(self.physical_sizes))
+        for name, sizes in (("Graph partition", self.part_sizes), ("Actual partition", self.physical_sizes)):
+            if name == "Actual partition" and not physical:
+                continue
+            min_size, max_size = min(sizes.values()), max(sizes.values())
+            print(f"{name} sizes:\n"\
+                f" Min: {min_size} ({(min_size - equal_part_size) / equal_part_size * 100:+6.3f}% from balanced partitioning)\n"\
+                f" Max: {max_size} ({(max_size - equal_part_size) / equal_part_size * 100:+6.3f}% from balanced partitioning)\n")
+
+def collect_statistics(connection, tablename, columns, part_col = "graph_partition", grouped = True, fetch_size = 100000):
+    '''
+    Computes all statistics of PartitionStatistics in a single scan: With grouped, the database groups the table by
+    (physical partition, partition identifier, key columns) in one query and the groups are aggregated client-side,
+    otherwise the tuples are streamed and aggregated client-side. Returns None if the query fails.
+    '''
+    cols = ", ".join(columns)
+    if grouped:
+        q = f"Select tid/10000000000000000, {part_col}, {cols}, count(*) from {tablename} "\
+            f"group by tid/10000000000000000, {part_col}, {cols}"
+    else:
+        q = f"Select tid/10000000000000000, {part_col}, {cols}, 1 from {tablename}"
+    cur = execute(connection, q)
+    if cur is None:
+        return None
+
+    cardinality = 0
+    physical_sizes = {}
+    part_sizes = {}
+    # Per column: key value -> [tuples, partition identifier, is exception]
+    values = [{} for _ in columns]
+    while True:
+        rows = cur.fetchmany(fetch_size)
+        if not rows:
+            break
+        for row in rows:
+            physical, part, count = row[0], row[1], row[-1]
+            cardinality += count
+            physical_sizes[physical] = physical_sizes.get(physical, 0) + count
+            part_sizes[part] = part_sizes.get(part, 0) + count
+            for i, v in enumerate(row[2:-1]):
+                state = values[i].get(v)
+                if state is None:
+                    values[i][v] = [count, part, part is not None and part < 0]
+                    continue
+                state[0] += count
+                if part is not None:
+                    if state[1] is None:
+                        state[1] = part
+                    elif state[1] != part or part < 0:
+                        state[2] = True
+    cur.close()
+
+    # NULL values count as distinct value, but never as exception (as count(distinct) and IN in num_exceptions)
+    distinct_values = {c: sum(1 for v in values[i] if v is not None) for i, c in enumerate(columns)}
+    exceptions = {c: sum(s[0] for v, s in values[i].items() if v is not None and s[2]) for i, c in enumerate(columns)}
+    return PartitionStatistics(tablename, columns, cardinality, physical_sizes, part_sizes, distinct_values, exceptions)
+
+
+def _z_value(confidence):
+    from statistics import NormalDist
+    return NormalDist().inv_cdf((1 + confidence) / 2)
+
+def _wilson_interval(k, n, z):
+    '''
+    Wilson score interval of the proportion k/n.
+    '''
+    if n == 0:
+        return (0.0, 1.0)
+    p = k / n
+    center = (p + z * z / (2 * n)) / (1 + z * z / n)
+    spread = z * ((p * (1 - p) / n + z * z / (4 * n * n)) ** 0.5) / (1 + z * z / n)
+    return (max(0.0, center - spread), min(1.0, center + spread))
+
+def _gee_distinct(frequencies, population, sample):
+    '''
+    GEE estimate (Charikar et al., 2000) of the distinct values of a population from the value frequencies
+    in a uniform sample: values seen once are scaled by sqrt(population / sample), the others counted once.
+    '''
+    if sample == 0:
+        return 0.0
+    f1 = sum(1 for f in frequencies if f == 1)
+    return (population / sample) ** 0.5 * f1 + (len(frequencies) - f1)
+
+class ApproximateStatistics:
+    '''
+    Partitioning statistics estimated from a sample of the table, see sample_statistics. Provides balance_factor()
+    and exception_rates as PartitionStatistics, plus confidence intervals for them (no exception rate intervals
+    if the sampled key values were not verified).
+    physical_sizes, physical_size_intervals: Estimated tuples per physical partition (simultaneous intervals)
+    distinct_values, part_distinct_values: Estimated distinct values per key column, and per key column and
+        physical partition; distinct_value_intervals only for the HyperLogLog estimates of method reservoir.
+    '''
+    def __init__(self, tablename, columns, method, confidence, cardinality, sample_size):
+        self.tablename = tablename
+        self.columns = columns
+        self.method = method
+        self.confidence = confidence
+        self.cardinality = cardinality
+        self.sample_size = sample_size
+        self.physical_sizes = {}
+        self.physical_size_intervals = {}
+        self.exception_rates = {}
+        self.exception_rate_intervals = {}
+        self.distinct_values = {}
+        self.distinct_value_intervals = {}
+        self.part_distinct_values = {}
+
+    def balance_factor(self):
+        sizes = self.physical_sizes.values()
+        return float(max(sizes)) / float(min(sizes))
+
+    def balance_factor_interval(self):
+        '''
+        The largest partition is at least the largest lower bound and the smallest at most the smallest
+        upper bound (and vice versa), which bounds max/min with the confidence of the size intervals.
+        '''
+        lower = [i[0] for i in self.physical_size_intervals.values()]
+        upper = [i[1] for i in self.physical_size_intervals.values()]
+        low = max(1.0, max(lower) / min(upper))
+        high = max(upper) / min(lower) if min(lower) > 0 else float("inf")
+        return (low, high)
+
+    def print(self):
+        print(f"\nTable: {self.tablename}\nColumns: {self.columns})")
+        print(f"Estimated from {self.sample_size} of {self.cardinality} tuples ({self.method}), "\
+            f"{self.confidence * 100:.0f}% confidence intervals")
+        for c in self.columns:
+            interval = self.distinct_value_intervals.get(c)
+            bounds = f" [{interval[0]:.0f}, {interval[1]:.0f}]" if interval is not None else ""
+            print(f"Distinct values of {c}: ~{self.distinct_values[c]:.0f}{bounds}")
+        for c in self.columns:
+            interval = self.exception_rate_intervals[c]
+            if interval is None:
+                print(f"Exception rate in column {c}: >= {self.exception_rates[c] * 100:6.3f}% (key values not verified)")
+                continue
+            low, high = interval
+            print(f"Exception rate in column {c}: {self.exception_rates[c] * 100:6.3f}% [{low * 100:.3f}%, {high * 100:.3f}%]")
+        low, high = self.balance_factor_interval()
+        print(f"Partition balance factor: {self.balance_factor():.3f} [{low:.3f}, {high:.3f}]")
+
+def _sample_exceptions(connection, tablename, part_col, column, col_idx, rows, verify_keys):
+    '''
+    Returns the number of sampled tuples that are exceptions in column. With verify_keys, the partition identifiers
+    of the sampled key values are looked up in the table, which makes the estimate unbiased. Without, a key value is an
+    exception if the sample contains it with several or negative partition identifiers, which misses exceptions
+    of key values that are rare in the sample, so the count is only a lower bound.
+    '''
+    keys = {}
+    for row in rows:
+        v = row[2 + col_idx]
+        if v is None:
+            continue
+        part = row[1]
+        state = keys.get(v)
+        if state is None:
+            keys[v] = [1, part, part is not None and part < 0]
+            continue
+        state[0] += 1
+        if part is not None:
+            if state[1] is None:
+                state[1] = part
+            elif state[1] != part or part < 0:
+                state[2] = True
+
+    if verify_keys and keys:
+        import numpy as np
+        from edge_loader import bulk_insert
+        q = f"DECLARE GLOBAL TEMPORARY TABLE sample_keys as select {column} as k from {tablename} where 1 = 0 "\
+            "ON COMMIT PRESERVE ROWS WITH NORECOVERY"
+        cur = execute(connection, q)
+        if cur is None:
+            return None
+        cur.close()
+        try:
+            if not bulk_insert(connection, "sample_keys", (np.array(list(keys), dtype=object),)):
+                return None
+            q = f"Select s.k, count(distinct t.{part_col}), min(t.{part_col}) from sample_keys s "\
+                f"join {tablename} t on t.{column} = s.k group by s.k"
+            cur = execute(connection, q)
+            if cur is None:
+                return None
+            for k, num_parts, min_part in cur.fetchall():
+                keys[k][2] = num_parts > 1 or (min_part is not None and min_part < 0)
+            cur.close()
+        finally:
+            execute(connection, "Drop table session.sample_keys", False, True).close()
+
+    return sum(state[0] for state in keys.values() if state[2])
+
+def sample_statistics(connection, tablename, columns, part_col = "graph_partition", sample_size = 100000, method = "tid",
+        confidence = 0.95, verify_keys = True, seed = 0, fetch_size = 100000, precision = 12):
+    '''
+    Estimates balance factor, exception rates and distinct values from a sample of about sample_size tuples
+    instead of the exact distinct counts of collect_statistics. Returns ApproximateStatistics or None on failure.
+    method "tid": The database returns a systematic sample (mod(tid, step) = offset), only the sample is transferred.
+        Distinct values are GEE estimates from the sample frequencies.
+    method "reservoir": All tuples are streamed and sampled client-side in bounded memory (for tables without
+        usable tid), partition sizes are exact and distinct values are HyperLogLog estimates over all tuples.
+    verify_keys: Looks up the partition identifiers of the sampled key values in the table. Without, the exception
+        rates are lower bounds from the sample alone (far too low if exceptions are spread over rare key values)
+        and have no confidence interval.
+    '''
+    import random
+    assert method in ("tid", "reservoir")
+    rng = random.Random(seed)
+    z = _z_value(confidence)
+    cols = ", ".join(columns)
+    q = f"Select tid/10000000000000000, {part_col}, {cols} from {tablename}"
+
+    if method == "tid":
+        cardinality = table_card(connection, tablename)
+        step = max(1, cardinality // sample_size)
+        cur = execute(connection, f"{q} where mod(tid, {step}) = {rng.randrange(step)}")
+        if cur is None:
+            return None
+        sample = []
+        while True:
+            rows = cur.fetchmany(fetch_size)
+            if not rows:
+                break
+            sample.extend(rows)
+        cur.close()
+        physical_counts = {}
+        for row in sample:
+            physical_counts[row[0]] = physical_counts.get(row[0], 0) + 1
+    else:
+        from hyperloglog import HyperLogLog
+        cur = execute(connection, q)
+        if cur is None:
+            return None
+        sample = []
+        cardinality = 0
+        physical_counts = {}
+        sketches = [HyperLogLog(precision) for _ in columns]
+        part_sketches = [{} for _ in columns]
+        while True:
+            rows = cur.fetchmany(fetch_size)
+            if not rows:
+                break
+            for row in rows:
+                physical_counts[row[0]] = physical_counts.get(row[0], 0) + 1
+            for i in range(len(columns)):
+                by_part = {}
+                for row in rows:
+                    by_part.setdefault(row[0], []).append(row[2 + i])
+                for part, values in by_part.items():
+                    if part not in part_sketches[i]:
+                        part_sketches[i][part] = HyperLogLog(precision)
+                    part_sketches[i][part].add(values)
+            # Reservoir sampling (algorithm R)
+            for row in rows:
+                if len(sample) < sample_size:
+                    sample.append(row)
+                else:
+                    j = rng.randrange(cardinality + 1)
+                    if j < sample_size:
+                        sample[j] = row
+                cardinality += 1
+        cur.close()
+        for i in range(len(columns)):
+            for sketch in part_sketches[i].values():
+                sketches[i].merge(sketch)
+
+    n = len(sample)
+    stats = ApproximateStatistics(tablename, columns, method, confidence, cardinality, n)
+    if method == "tid":
+        # Simultaneous intervals over all partitions (Bonferroni)
+        z_parts = _z_value(1 - (1 - confidence) / max(1, len(physical_counts)))
+        for p, k in physical_counts.items():
+            stats.physical_sizes[p] = cardinality * k / n
+            low, high = _wilson_interval(k, n, z_parts)
+            stats.physical_size_intervals[p] = (cardinality * low, cardinality * high)
+    else:
+        stats.physical_sizes = dict(physical_counts)
+        stats.physical_size_intervals = {p: (k, k) for p, k in physical_counts.items()}
+
+    for i, c in enumerate(columns):
+        exceptions = _sample_exceptions(connection, tablename, part_col, c, i, sample, verify_keys)
+        if exceptions is None:
+            return None
+        stats.exception_rates[c] = exceptions / n if n else 0.0
+        # Unverified exception counts are biased low, a confidence interval around them would be misleading
+        stats.exception_rate_intervals[c] = _wilson_interval(exceptions, n, z) if verify_keys else None
+
+        if method == "tid":
+            frequencies = {}
+            part_frequencies = {}
+            for row in sample:
+                v = row[2 + i]
+                if v is None:
+                    continue
+                frequencies[v] = frequencies.get(v, 0) + 1
+                f = part_frequencies.setdefault(row[0], {})
+                f[v] = f.get(v, 0) + 1
+            stats.distinct_values[c] = _gee_distinct(frequencies.values(), cardinality, n)
+            stats.part_distinct_values[c] = {part: _gee_distinct(f.values(), cardinality, n)
+                for part, f in part_frequencies.items()}
+        else:
+            stats.distinct_values[c] = sketches[i].estimate()
+            stats.distinct_value_intervals[c] = sketches[i].interval(z)
+            stats.part_distinct_values[c] = {part: s.estimate() for part, s in part_sketches[i].items()}
+    return stats
+
+
+def file_statistics(filenames, key_offsets, columns = None, part_id_map = None, delimiter = "|", null_value = "", chunk_size = 100000):
+    '''
+    Computes PartitionStatistics (the metrics of partition_balance_factor and num_exceptions) from partitioned
+    flat files as written by IterativePartitioner.partitioned_file_from_file, without a database: the last field
+    of each line is the partition identifier, key_offsets are the field offsets of the key columns.
+    The files are read in chunks of chunk_size lines, memory is bounded by the distinct key values.
+    Physical partitions are the offsets in part_id_map if given, otherwise the partition identifiers.
+    Key values equal to null_value are NULL and never exceptions.
+    '''
+    import numpy as np
+    from csv import reader
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    if columns is None:
+        columns = [f"col{off}" for off in key_offsets]
+    part_offs = {part: off for off, part in enumerate(part_id_map)} if part_id_map is not None else None
+
+    cardinality = 0
+    part_sizes = {}
+    # Per column: key value -> [tuples, min partition identifier, max partition identifier]
+    values = [{} for _ in key_offsets]
+
+    def add_chunk(rows):
+        parts = np.fromiter((int(row[-1]) for row in rows), dtype=np.int64, count=len(rows))
+        ids, counts = np.unique(parts, return_counts=True)
+        for part, count in zip(ids.tolist(), counts.tolist()):
+            part_sizes[part] = part_sizes.get(part, 0) + count
+        for i, off in enumerate(key_offsets):
+            keys, inverse = np.unique(np.array([row[off] for row in rows]), return_inverse=True)
+            inverse = inverse.reshape(-1)
+            min_parts = np.full(len(keys), np.iinfo(np.int64).max)
+            max_parts = np.full(len(keys), np.iinfo(np.int64).min)
+            np.minimum.at(min_parts, inverse, parts)
+            np.maximum.at(max_parts, inverse, parts)
+            key_counts = np.bincount(inverse, minlength=len(keys))
+            for key, count, lo, hi in zip(keys.tolist(), key_counts.tolist(), min_parts.tolist(), max_parts.tolist()):
+                state = values[i].get(key)
+                if state is None:
+                    values[i][key] = [count, lo, hi]
+                else:
+                    state[0] += count
+                    state[1] = min(state[1], lo)
+                    state[2] = max(state[2], hi)
+
+    for filename in filenames:
+        with open(filename, 'r') as read_obj:
+            rows = []
+            for row in reader(read_obj, delimiter=delimiter):
+                rows.append(row)
+                if len(rows) >= chunk_size:
+                    add_chunk(rows)
+                    cardinality += len(rows)
+                    rows = []
+            if rows:
+                add_chunk(rows)
+                cardinality += len(rows)
+
+    if part_offs is not None:
+        physical_sizes = {part_offs[part]: count for part, count in part_sizes.items()}
+    else:
+        physical_sizes = dict(part_sizes)
+    distinct_values = {}
+    exceptions = {}
+    for i, c in enumerate(columns):
+        values[i].pop(null_value, None)
+        distinct_values[c] = len(values[i])
+        exceptions[c] = sum(s[0] for s in values[i].values() if s[1] != s[2] or s[1] < 0)
+    return PartitionStatistics(", ".join(filenames), columns, cardinality, physical_sizes, part_sizes, distinct_values, exceptions)
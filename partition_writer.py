@@ -0,0 +1,53 @@
+import os
+
+def shard_filenames(part_filename, num_partitions):
+    '''
+    Names of the per-partition files for part_filename. The file of partition offset i is loaded into
+    the physical partition i (the partition identifier mapping maps offset i to hash bucket i), the
+    zero padded offsets keep the names in partition order.
+    '''
+    base, extension = os.path.splitext(part_filename)
+    width = len(str(num_partitions - 1))
+    return [f"{base}_p{off:0{width}d}{extension}" for off in range(num_partitions)]
+
+class PartitionFileWriter:
+    '''
+    Writes lines into one file per partition, keeping the line order within each file.
+    Lines are buffered per partition; once all buffers together exceed buffer_bytes,
+    the largest buffers are flushed until half of the budget is free again.
+    '''
+    def __init__(self, filenames, buffer_bytes = 64 * 1024 * 1024):
+        self.filenames = filenames
+        self.buffer_bytes = buffer_bytes
+        self.buffers = [[] for _ in filenames]
+        self.buffered = [0] * len(filenames)
+        self.total_buffered = 0
+        # All files are created, so that empty partitions have an (empty) file as well
+        self.files = [open(f, 'w') for f in filenames]
+
+    def write(self, part_off, text):
+        self.buffers[part_off].append(text)
+        self.buffered[part_off] += len(text)
+        self.total_buffered += len(text)
+        if self.total_buffered > self.buffer_bytes:
+            for off in sorted(range(len(self.buffers)), key=lambda o: self.buffered[o], reverse=True):
+                if self.total_buffered <= self.buffer_bytes / 2:
+                    break
+                self._flush(off)
+
+    def _flush(self, part_off):
+        self.files[part_off].write("".join(self.buffers[part_off]))
+        self.total_buffered -= self.buffered[part_off]
+        self.buffers[part_off] = []
+        self.buffered[part_off] = 0
+
+    def close(self):
+        for off, f in enumerate(self.files):
+            self._flush(off)
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
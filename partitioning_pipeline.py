@@ -0,0 +1,199 @@
+'''
+Multi-process variant of IterativePartitioner.partitioned_file_from_file.
+
+Worker processes split the input file into byte ranges, parse them and dictionary-encode the
+partition key columns into shared memory slots, along with the parsed lines. The partitioner assigns
+the chunks in input order (the only sequential step) and writes the partition identifiers back into
+the slot, from where the workers format the output lines without parsing the range again.
+The output is written in input order and is identical to that of the sequential path.
+NOTE: Byte ranges are split at line breaks, so records must not contain quoted line breaks.
+'''
+import io
+import os
+from csv import reader
+from collections import deque
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from partition_writer import PartitionFileWriter
+
+CHUNK_BYTES = 16 * 1024 * 1024
+
+# Shared memory slots attached by each worker process
+_slots = {}
+
+def _attach_slots(slot_names):
+    for slot, name in enumerate(slot_names):
+        _slots[slot] = SharedMemory(name)
+
+def _slot_views(shm, num_keys, capacity):
+    '''
+    A slot holds the key codes and partition identifiers of up to capacity tuples, followed by the
+    parsed lines of the byte range (UTF-8, without the partition identifier).
+    '''
+    codes = np.ndarray((num_keys, capacity), dtype=np.int32, buffer=shm.buf)
+    parts = np.ndarray(capacity, dtype=np.int64, buffer=shm.buf, offset=codes.nbytes)
+    return (codes, parts, shm.buf[codes.nbytes + parts.nbytes:])
+
+def _read_range(filename, start, end):
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    # Same decoding and newline handling as open(filename, 'r')
+    return reader(io.TextIOWrapper(io.BytesIO(data)), delimiter='|')
+
+def _parse_range(filename, start, end, key_map, slot, capacity):
+    '''
+    Parses the byte range once: the key codes and the lines for _format_range go into the slot.
+    Returns the number of tuples, the key values per key and, if the range does not fit into the slot,
+    the key codes and lines themselves (otherwise None and the length of the lines in the slot).
+    '''
+    codes, _, text = _slot_views(_slots[slot], len(key_map), capacity)
+    columns = [[] for _ in key_map]
+    lines = []
+    for row in _read_range(filename, start, end):
+        for cnt, idx in enumerate(key_map):
+            columns[cnt].append(row[idx])
+        lines.append('|'.join(row))
+    data = "\n".join(lines).encode()
+
+    num_rows = len(lines)
+    key_codes = []
+    key_dicts = []
+    for column in columns:
+        values = {}
+        key_codes.append(np.fromiter((values.setdefault(v, len(values)) for v in column), dtype=np.int32, count=num_rows))
+        key_dicts.append(list(values))
+
+    # Slots are sized for the sampled row length, ranges with shorter rows are passed through the pool
+    if num_rows > capacity or len(data) > len(text):
+        return (num_rows, key_dicts, key_codes, data)
+    for cnt, c in enumerate(key_codes):
+        codes[cnt, :num_rows] = c
+    text[:len(data)] = data
+    return (num_rows, key_dicts, None, len(data))
+
+def _assign_slot(partitioner, shm, capacity, num_rows, key_dicts, key_codes = None):
+    '''
+    Assigns the tuples of a parsed range. Returns their partition identifiers if the range did not fit into the slot.
+    '''
+    if key_codes is not None:
+        return partitioner.get_fact_partitions(key_codes, key_dicts)
+    codes, parts, _ = _slot_views(shm, partitioner.num_keys, capacity)
+    parts[:num_rows] = partitioner.get_fact_partitions([c[:num_rows] for c in codes], key_dicts)
+    return None
+
+def _format_range(num_keys, slot, capacity, num_rows, data, parts = None, part_id_map = None):
+    '''
+    Returns the output lines of a parsed range, or a list with the lines of each partition if part_id_map is given.
+    data and parts are the lines and partition identifiers if the range did not fit into the slot, otherwise
+    data is the length of the lines in the slot.
+    '''
+    if parts is None:
+        _, parts, text = _slot_views(_slots[slot], num_keys, capacity)
+        parts = parts[:num_rows]
+        data = bytes(text[:data])
+    lines = (f"{line}|{part}\n" for line, part in zip(data.decode().split("\n") if num_rows else [], parts.tolist()))
+    if part_id_map is None:
+        return "".join(lines)
+
+    part_offs = {part: off for off, part in enumerate(part_id_map)}
+    shards = [[] for _ in part_id_map]
+    for line, part in zip(lines, parts.tolist()):
+        shards[part_offs[part]].append(line)
+    return ["".join(s) for s in shards]
+
+def _sample_row_bytes(filename, num_samples = 16, sample_bytes = 1 << 16):
+    '''
+    Average bytes per line of num_samples evenly spaced samples of filename.
+    '''
+    size = os.path.getsize(filename)
+    total_bytes = 0
+    total_lines = 0
+    with open(filename, 'rb') as f:
+        for i in range(num_samples):
+            f.seek(size * i // num_samples)
+            data = f.read(sample_bytes)
+            total_bytes += len(data)
+            total_lines += data.count(b"\n")
+    return total_bytes / max(1, total_lines)
+
+def split_file(filename, chunk_bytes = CHUNK_BYTES):
+    '''
+    Splits filename into byte ranges of about chunk_bytes that start at line beginnings.
+    '''
+    size = os.path.getsize(filename)
+    bounds = [0]
+    with open(filename, 'rb') as f:
+        for target in range(chunk_bytes, size, chunk_bytes):
+            # The next line beginning at or after target
+            f.seek(target - 1)
+            f.readline()
+            if bounds[-1] < f.tell() < size:
+                bounds.append(f.tell())
+    bounds.append(size)
+    return [r for r in zip(bounds[:-1], bounds[1:]) if r[0] < r[1]]
+
+def partitioned_file_from_file(partitioner, tablename, filename, part_filenames, num_workers, sharded = False, chunk_bytes = CHUNK_BYTES):
+    '''
+    Writes the fact tuples of filename with their partition identifiers appended, using num_workers
+    processes for parsing and formatting. part_filenames holds the output file, or one file
+    per partition offset if sharded (see partition_writer.shard_filenames).
+    Returns the number of written tuples.
+    '''
+    t_off = partitioner._get_table_off_by_name(tablename)
+    # Every tuple has at least one delimiter or line break per column (p is not part of the file)
+    min_row_bytes = max(1, len(partitioner.tables[t_off].colnames) - 1)
+    # Room for twice the tuples of the sampled row length, ranges with more tuples bypass the slot
+    capacity = int(min(chunk_bytes // min_row_bytes, 2 * chunk_bytes / _sample_row_bytes(filename))) + 1
+    num_keys = partitioner.num_keys
+    ranges = split_file(filename, chunk_bytes)
+    # Parsed lines are at most as long as their byte range
+    text_bytes = max((end - start for start, end in ranges), default=0)
+
+    num_slots = 2 * num_workers
+    slots = [SharedMemory(create=True, size=capacity * (4 * num_keys + 8) + text_bytes) for _ in range(num_slots)]
+    total = 0
+    try:
+        write_obj = PartitionFileWriter(part_filenames) if sharded else open(part_filenames[0], 'w')
+        with Pool(num_workers, initializer=_attach_slots, initargs=([s.name for s in slots],)) as pool, write_obj:
+            free_slots = list(range(num_slots))
+            parsing = deque()
+            formatting = deque()
+            next_range = 0
+
+            while next_range < len(ranges) or parsing or formatting:
+                while free_slots and next_range < len(ranges):
+                    slot = free_slots.pop()
+                    start, end = ranges[next_range]
+                    parsing.append((slot, pool.apply_async(_parse_range,
+                        (filename, start, end, partitioner.key_map, slot, capacity))))
+                    next_range += 1
+
+                # Assign the oldest parsed chunk, chunks must be assigned in input order
+                if parsing:
+                    slot, result = parsing.popleft()
+                    num_rows, key_dicts, key_codes, data = result.get()
+                    parts = _assign_slot(partitioner, slots[slot], capacity, num_rows, key_dicts, key_codes)
+                    formatting.append((slot, num_rows, pool.apply_async(_format_range,
+                        (num_keys, slot, capacity, num_rows, data, parts, partitioner.part_id_map if sharded else None))))
+
+                # Write formatted chunks in input order, block only if no slot is left for parsing
+                while formatting and (formatting[0][2].ready() or (not parsing and
+                        (not free_slots or next_range == len(ranges)))):
+                    slot, num_rows, result = formatting.popleft()
+                    if sharded:
+                        for part_off, lines in enumerate(result.get()):
+                            if lines:
+                                write_obj.write(part_off, lines)
+                    else:
+                        write_obj.write(result.get())
+                    total += num_rows
+                    free_slots.append(slot)
+    finally:
+        for s in slots:
+            s.close()
+            s.unlink()
+    return total
@@ -0,0 +1,125 @@
+'''
+Local stand-in for the Actian Vector database, for benchmarks and experiments without a Vector installation:
+A DB-API connection over sqlite3 that rewrites the Vector SQL issued by the partitioners into SQLite and
+emulates the physical partitioning through the tid column (tid/10000000000000000 is the partition).
+
+Tables that are partitioned must have a BIGINT tid column, which inserts without column list leave out
+(temporary tables have no implicit tid, their tid column is a user column).
+"Modify ... reconstruct with partition=(hash on c n partitions)" recomputes the tids from hash(c), where hash
+maps the partition identifiers of identifier_mapping_dict for num_partitions to their Vector hash buckets, so
+that the identifier mappings of the partitioners balance the partitions as on Vector.
+'''
+import hashlib
+import random
+import re
+import sqlite3
+
+from identifier_mapping_dict import partition_identifier_mapping_dict
+
+_NULL_SAFE_EQUAL = re.compile(r"\((\w+\.\w+) = (\w+\.\w+) OR \1 is null and \2 is null\)", re.IGNORECASE)
+_DGTT = re.compile(r"DECLARE GLOBAL TEMPORARY TABLE (?:session\.)?(\w+)\s*(.*?)\s*(?:ON COMMIT PRESERVE ROWS WITH NORECOVERY)?\s*$",
+    re.IGNORECASE | re.DOTALL)
+_TOP = re.compile(r"^\s*select top (\d+) (.*)$", re.IGNORECASE | re.DOTALL)
+_UPDATE_FROM = re.compile(r"^\s*update (\w+) (\w+) from (\w+) set \2\.(\w+) = (.*?) where (.*)$", re.IGNORECASE | re.DOTALL)
+_RECONSTRUCT = re.compile(r"^\s*Modify (\w+) to reconstruct with partition=\(hash on (\w+) (\d+) partitions\)\s*$", re.IGNORECASE)
+_COMBINE = re.compile(r"^\s*Modify (\w+) to combine\s*$", re.IGNORECASE)
+_INSERT = re.compile(r"^\s*insert into (\w+) values", re.IGNORECASE)
+
+def _stable_hash(value):
+    if value is None:
+        return None
+    if isinstance(value, int):
+        return (value * 0x9E3779B97F4A7C15) & 0x7FFFFFFFFFFFFFFF
+    return int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), "little") & 0x7FFFFFFFFFFFFFFF
+
+class StandinCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = connection.sqlite.cursor()
+
+    def execute(self, sql, parameters = ()):
+        self.cursor.execute(self.connection.rewrite(sql), parameters)
+        return self
+
+    def executemany(self, sql, rows):
+        self.cursor.executemany(self.connection.rewrite(sql), rows)
+        return self
+
+    def __getattr__(self, name):
+        # fetchone, fetchmany, fetchall, description, close, ...
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+class StandinConnection:
+    '''
+    num_partitions: The partition count whose partition identifiers hash emulates.
+    '''
+    def __init__(self, database = ":memory:", num_partitions = None, seed = 0):
+        self.sqlite = sqlite3.connect(database, check_same_thread=False)
+        self.rng = random.Random(seed)
+        mapping = partition_identifier_mapping_dict.get(num_partitions, [])
+        self.identifier_buckets = {ident: bucket for bucket, ident in enumerate(mapping)}
+        self.sqlite.create_function("mod", 2, lambda a, b: None if a is None or b is None else a % b, deterministic=True)
+        self.sqlite.create_function("hash", 1, self._hash, deterministic=True)
+        self.sqlite.create_function("random", 2, lambda lo, hi: self.rng.randint(lo, hi))
+
+    def _hash(self, value):
+        bucket = self.identifier_buckets.get(value)
+        return bucket if bucket is not None else _stable_hash(value)
+
+    def _columns(self, table):
+        return [row[1] for row in self.sqlite.execute(f"pragma table_info({table})")]
+
+    def _has_implicit_tid(self, table):
+        temp = self.sqlite.execute("select 1 from sqlite_temp_master where type = 'table' and lower(name) = lower(?)",
+            (table,)).fetchone()
+        return temp is None and "tid" in self._columns(table)
+
+    def rewrite(self, sql):
+        '''
+        Translates a Vector statement into SQLite, statements without Vector specifics are returned unchanged.
+        '''
+        sql = _NULL_SAFE_EQUAL.sub(r"(\1 IS \2)", sql)
+        sql = re.sub(r"\bsession\.", "", sql, flags=re.IGNORECASE)
+        m = _DGTT.match(sql)
+        if m:
+            return f"create temp table {m.group(1)} {m.group(2)}"
+        m = _TOP.match(sql)
+        if m:
+            return f"select {m.group(2)} limit {m.group(1)}"
+        m = _UPDATE_FROM.match(sql)
+        if m:
+            table, alias, source, column, value, cond = m.groups()
+            return f"update {table} as {alias} set {column} = {value} from {source} where {cond}"
+        m = _RECONSTRUCT.match(sql)
+        if m:
+            table, column, n = m.groups()
+            # Dense tids per partition, in the order of the current tids
+            return f"update {table} set tid = r.part * 10000000000000000 + r.off from ("\
+                f"select rowid as rid, mod(hash({column}), {n}) as part, "\
+                f"row_number() over (partition by mod(hash({column}), {n}) order by tid, rowid) - 1 as off from {table}) r "\
+                f"where r.rid = {table}.rowid"
+        if _COMBINE.match(sql):
+            return "select 1"
+        m = _INSERT.match(sql)
+        if m and self._has_implicit_tid(m.group(1)):
+            columns = [c for c in self._columns(m.group(1)) if c != "tid"]
+            return _INSERT.sub(f"insert into {m.group(1)} ({', '.join(columns)}) values", sql)
+        return sql
+
+    def cursor(self):
+        return StandinCursor(self)
+
+    def execute(self, sql, parameters = ()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, rows):
+        return self.cursor().executemany(sql, rows)
+
+    def commit(self):
+        self.sqlite.commit()
+
+    def close(self):
+        self.sqlite.close()
@@ -0,0 +1,88 @@
+class StreamingStatistics:
+    '''
+    Online partitioning statistics of the IterativePartitioner, replacing the traced key values.
+    Keeps per partition tuple counts, per key the number of mapped and exception key values and per key
+    and partition the number of tuples whose key value is an exception (in the final mappings, as
+    print_statistics reports it).
+    All tuples of a mapped key value are in its partition, so a key value only needs a tuple counter
+    until it becomes an exception, then the counter moves to the exception count of its partition.
+    The counters are kept next to the entries of the mappings (see mapping_store.CompactKeyMapping.add_count),
+    so memory is O(partitions x keys) plus 8 bytes per distinct key value, independent of the number of tuples.
+    '''
+    def __init__(self, part_id_map, exception_marker):
+        self.num_partitions = len(part_id_map)
+        self.part_offsets = {p: i for i, p in enumerate(part_id_map)}
+        self.exception_marker = exception_marker
+        self.tuples = [0] * self.num_partitions
+        self.exceptions = []
+        self.mapped_values = []
+        self.exception_values = []
+
+    def add_key(self):
+        self.exceptions.append([0] * self.num_partitions)
+        self.mapped_values.append(0)
+        self.exception_values.append(0)
+
+    def add_tuple(self, mappings, part_off, lookups, updates, values, count = 1):
+        '''
+        Accounts a tuple (or count equal tuples) assigned to part_off, given the lookups and updates of
+        _resolve_fact_lookups. The updates must already be applied to mappings.
+        '''
+        self.tuples[part_off] += count
+        for cnt, value in enumerate(values):
+            if updates[cnt] == self.exception_marker:
+                # The value was mapped to lookups[cnt] so far, all of its tuples are exceptions now
+                self.exceptions[cnt][self.part_offsets[lookups[cnt]]] += mappings[cnt].pop_count(value)
+                self.mapped_values[cnt] -= 1
+                self.exception_values[cnt] += 1
+            elif updates[cnt] is not None:
+                self.mapped_values[cnt] += 1
+            if updates[cnt] == self.exception_marker or \
+                    updates[cnt] is None and lookups[cnt] == self.exception_marker:
+                self.exceptions[cnt][part_off] += count
+            else:
+                mappings[cnt].add_count(value, count)
+
+    def add_tuples(self, mappings, part_offs, key_codes, key_dicts, exception_masks, new_masks):
+        '''
+        Accounts a run of tuples without conflicts (see IterativePartitioner.get_fact_partitions).
+        key_codes holds the dictionary codes of the run per key, exception_masks the tuples whose
+        key value is an exception and new_masks the tuples whose key value got mapped in the run.
+        '''
+        import numpy as np
+        counts = np.bincount(part_offs, minlength=self.num_partitions)
+        for part_off in np.flatnonzero(counts):
+            self.tuples[part_off] += int(counts[part_off])
+
+        for cnt, (codes, mask) in enumerate(zip(key_codes, exception_masks)):
+            exceptions = np.bincount(part_offs[mask], minlength=self.num_partitions)
+            for part_off in np.flatnonzero(exceptions):
+                self.exceptions[cnt][part_off] += int(exceptions[part_off])
+            self.mapped_values[cnt] += int(np.count_nonzero(new_masks[cnt]))
+            mapped, mapped_counts = np.unique(codes[~mask], return_counts=True)
+            for c, n in zip(mapped.tolist(), mapped_counts.tolist()):
+                mappings[cnt].add_count(key_dicts[cnt][c], n)
+
+    def exception_tuples(self, key_idx):
+        return sum(self.exceptions[key_idx])
+
+    def distinct_values(self, key_idx):
+        '''
+        Number of distinct values of the key seen so far, mapped or exception.
+        '''
+        return self.mapped_values[key_idx] + self.exception_values[key_idx]
+
+    def report_lines(self, key_map):
+        '''
+        One line per partition: key columns, partition offset, tuples and the exception percentage per key.
+        '''
+        lines = []
+        for part in range(self.num_partitions):
+            line = key_map + [part] + [self.tuples[part]]
+            for key_idx in range(len(self.exceptions)):
+                exp_perc = None
+                if self.tuples[part] > 0:
+                    exp_perc = self.exceptions[key_idx][part] / self.tuples[part] * 100
+                line.append(exp_perc)
+            lines.append("|".join(str(round(x,2)) if x is not None else "NaN" for x in line))
+        return lines
@@ -0,0 +1,41 @@
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from IterativePartitioner import IterativePartitioner
+
+
+def _partitioner(num_keys, num_partitions, trace_partitions):
+    p = IterativePartitioner(None, num_partitions, trace_partitions)
+    p.new_fact_table("f", [f"c{i}" for i in range(num_keys + 1)], ["varchar(10)"] * (num_keys + 1))
+    for i in range(num_keys):
+        p.add_partition_key("f", f"c{i}")
+    return p
+
+
+def _rows(seed, num_rows, num_keys):
+    rnd = random.Random(seed)
+    cards = [rnd.choice([3, 50, 400, 3000]) for _ in range(num_keys)]
+    return [[str(int(rnd.paretovariate(1.2)) % c) for c in cards] + ["x"] for _ in range(num_rows)]
+
+
+def test_fact_partitions_match_row_by_row():
+    for seed in range(12):
+        num_keys = 1 + seed % 4
+        num_partitions = [4, 8, 16, 96][seed % 4]
+        trace = seed % 2 == 0
+        rows = _rows(seed, 3000, num_keys)
+        row_wise = _partitioner(num_keys, num_partitions, trace)
+        expected = [row_wise._get_fact_partition(r) for r in rows]
+        for batch_size in [1, 50, 777, 3000]:
+            batched = _partitioner(num_keys, num_partitions, trace)
+            result = []
+            for i in range(0, len(rows), batch_size):
+                result += batched.get_fact_partitions(*batched.encode_key_columns(rows[i:i + batch_size])).tolist()
+            assert result == expected, (seed, batch_size)
+            assert batched.mappings == row_wise.mappings, (seed, batch_size)
+            assert batched.partition_counts == row_wise.partition_counts, (seed, batch_size)
+            assert batched.last_choice == row_wise.last_choice, (seed, batch_size)
+            assert batched.partitions == row_wise.partitions, (seed, batch_size)
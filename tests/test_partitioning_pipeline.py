@@ -0,0 +1,44 @@
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import partitioning_pipeline
+from IterativePartitioner import IterativePartitioner
+
+
+def _partitioner():
+    p = IterativePartitioner(None, 16, False)
+    p.new_fact_table("f", ["a", "b", "c", "d", "e"], ["int", "varchar(5)", "float", "int", "varchar(50)"])
+    for c in ["a", "b", "d"]:
+        p.add_partition_key("f", c)
+    return p
+
+
+def _write_input(filename, num_rows):
+    rnd = random.Random(5)
+    with open(filename, "w") as f:
+        for i in range(num_rows):
+            v = int(rnd.paretovariate(0.9)) % 3000
+            f.write(f"{v % 37}|n{v}|{rnd.random():.3f}|{int(rnd.paretovariate(1.1)) % 500}|" + "y" * (i % 80) + "\n")
+
+
+def _read(files):
+    contents = []
+    for name in files:
+        with open(name, "rb") as f:
+            contents.append(f.read())
+    return contents
+
+
+def test_workers_write_the_sequential_file(tmp_path):
+    filename = str(tmp_path / "f.tbl")
+    _write_input(filename, 50000)
+    for sharded in (False, True):
+        result = _partitioner().partitioned_file_from_file("f", filename, True, sharded=sharded)
+        expected = _read(result if sharded else [result])
+        files = [str(tmp_path / f"parallel_{sharded}_{i}.tbl") for i in range(16 if sharded else 1)]
+        # Small byte ranges, so that the workers split the file into several chunks
+        partitioning_pipeline.partitioned_file_from_file(_partitioner(), "f", filename, files, 3, sharded, 256 * 1024)
+        assert _read(files) == expected
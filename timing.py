@@ -1,4 +1,5 @@
 import time
+from contextlib import contextmanager
 
 def tik():
     return time.perf_counter()
@@ -8,4 +9,241 @@ def tok(start, out_str = None):
     if out_str:
         print(f"{out_str} {t:.03f} seconds")
     else:
-        return t
\ No newline at end of file
+        return t
+
+class StageTimer:
+    '''
+    Busy and idle (waiting for other stages) time of a pipeline stage, for stages that run overlapped.
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.busy = 0.0
+        self.idle = 0.0
+        self.first = None
+        self.last = None
+
+    def _add(self, start, attr):
+        end = time.perf_counter()
+        setattr(self, attr, getattr(self, attr) + end - start)
+        self.first = start if self.first is None else min(self.first, start)
+        self.last = end if self.last is None else max(self.last, end)
+
+    def add_busy(self, start):
+        self._add(start, "busy")
+
+    def add_idle(self, start):
+        self._add(start, "idle")
+
+def print_stage_times(stages, wall_time):
+    '''
+    Prints busy and idle time of each stage and the overlap, i.e. the busy time saved compared to running the stages one after another.
+    '''
+    for s in stages:
+        print(f"### Stage {s.name}: busy {s.busy:.03f} seconds, idle {s.idle:.03f} seconds")
+    print(f"### Total busy {sum(s.busy for s in stages):.03f} seconds in {wall_time:.03f} seconds wall time, "\
+        f"overlap {sum(s.busy for s in stages) - wall_time:.03f} seconds")
+
+def max_rss():
+    '''
+    High-water mark of the resident set size of this process in bytes, None where not available.
+    '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    import sys
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return rss if sys.platform == "darwin" else rss * 1024
+
+class Span:
+    '''
+    A timed section of a run with counters (e.g. rows, edges, bytes, queries) and nested child spans.
+    Rates are derived for integer counters.
+    rss_peak is the RSS high-water mark of the process when the span ended.
+    '''
+    def __init__(self, name, parent = None):
+        self.name = name
+        self.parent = parent
+        self.children = []
+        self.counters = {}
+        self.timestamp = time.time()
+        self.start = time.perf_counter()
+        self.end = None
+        self.rss_peak = None
+
+    def add(self, counter, value = 1):
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def finish(self):
+        self.end = time.perf_counter()
+        self.rss_peak = max_rss()
+
+    @property
+    def seconds(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def to_dict(self):
+        seconds = self.seconds
+        return {"name": self.name, "timestamp": self.timestamp, "seconds": seconds, "rss_peak_bytes": self.rss_peak,
+            "counters": dict(self.counters),
+            "rates": {f"{c}_per_second": v / seconds for c, v in self.counters.items() if isinstance(v, int) and seconds > 0},
+            "children": [c.to_dict() for c in self.children]}
+
+class Tracer:
+    '''
+    Records nested spans. Every thread has its own stack of open spans, counters are added to the innermost
+    open span of the calling thread. Worker threads continue a span of their creator with attach.
+    '''
+    def __init__(self):
+        import threading
+        self.roots = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def current(self):
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    @contextmanager
+    def span(self, name, out_str = None, **counters):
+        '''
+        Opens a child span of the current span. With out_str, prints the runtime as tok does.
+        '''
+        parent = self.current()
+        s = Span(name, parent)
+        for counter, value in counters.items():
+            s.add(counter, value)
+        with self._lock:
+            (parent.children if parent is not None else self.roots).append(s)
+        stack = self._stack()
+        stack.append(s)
+        try:
+            yield s
+        finally:
+            stack.pop()
+            s.finish()
+            if out_str:
+                print(f"{out_str} {s.seconds:.03f} seconds")
+
+    @contextmanager
+    def attach(self, span):
+        '''
+        Continues span in the calling thread, its counters are added to span.
+        '''
+        stack = self._stack()
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            stack.pop()
+
+    def wrap(self, fn):
+        '''
+        Returns fn continuing the current span, as target of worker threads.
+        '''
+        span = self.current()
+        def run(*args, **kwargs):
+            with self.attach(span):
+                return fn(*args, **kwargs)
+        return run
+
+    def record(self, name, seconds, **counters):
+        '''
+        Adds a finished child span of the current span, for work that was timed otherwise (e.g. StageTimer).
+        '''
+        with self.span(name, **counters) as s:
+            pass
+        s.start = s.end - seconds
+        return s
+
+    def count(self, counter, value = 1):
+        s = self.current()
+        if s is not None:
+            with self._lock:
+                s.add(counter, value)
+
+    def reset(self):
+        with self._lock:
+            self.roots = []
+
+    def to_json(self, filename = None):
+        '''
+        Returns the spans as JSON, and writes them to filename if given.
+        '''
+        import json
+        text = json.dumps([s.to_dict() for s in self.roots], indent=2)
+        if filename:
+            with open(filename, "w") as f:
+                f.write(text)
+        return text
+
+    def write_prometheus(self, filename, prefix = "partitioning"):
+        '''
+        Writes the spans in the Prometheus text format, e.g. for the textfile collector of the node exporter.
+        Spans are labelled with their path, repeated sibling names are numbered (run, run#2, ...).
+        The file is replaced atomically, so that collectors never read partially written files.
+        '''
+        import os
+        import re
+        metrics = {}
+        def sample(metric, path, value, extra = ""):
+            metrics.setdefault(metric, []).append(f'{metric}{{span="{path}"{extra}}} {value}')
+
+        def add(spans, prefix_path):
+            seen = {}
+            for s in spans:
+                seen[s.name] = seen.get(s.name, 0) + 1
+                name = s.name if seen[s.name] == 1 else f"{s.name}#{seen[s.name]}"
+                path = (prefix_path + "/" + name).lstrip("/").replace("\\", "\\\\").replace('"', '\\"')
+                sample(f"{prefix}_span_seconds", path, s.seconds)
+                if s.rss_peak is not None:
+                    sample(f"{prefix}_span_rss_peak_bytes", path, s.rss_peak)
+                for counter, value in s.counters.items():
+                    sample(f"{prefix}_span_{re.sub('[^a-zA-Z0-9_]', '_', counter)}_total", path, value)
+                add(s.children, prefix_path + "/" + name)
+        add(self.roots, "")
+
+        tmp_file = f"{filename}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as f:
+            for metric, lines in metrics.items():
+                f.write(f"# TYPE {metric} gauge\n")
+                f.write("\n".join(lines) + "\n")
+        os.replace(tmp_file, filename)
+
+    def report_lines(self):
+        '''
+        One line per span, indented by depth: runtime, counters with rates and RSS high-water mark.
+        '''
+        lines = []
+        def add(spans, depth):
+            for s in spans:
+                seconds = s.seconds
+                counters = "".join(f", {c} {v} ({v / seconds:.0f}/s)" if isinstance(v, int) and seconds > 0 else f", {c} {v}"
+                    for c, v in s.counters.items())
+                rss = f", peak RSS {s.rss_peak / 2**20:.0f} MiB" if s.rss_peak is not None else ""
+                lines.append(f"{'  ' * depth}{s.name}: {seconds:.03f} seconds{counters}{rss}")
+                add(s.children, depth + 1)
+        add(self.roots, 0)
+        return lines
+
+def traced(name):
+    '''
+    Decorator running the function in a span of tracer.
+    '''
+    import functools
+    def decorator(fn):
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            with tracer.span(name):
+                return fn(*args, **kwargs)
+        return run
+    return decorator
+
+# The tracer of all partitioners, exported with tracer.to_json or tracer.write_prometheus
+tracer = Tracer()